@@ -0,0 +1,94 @@
+"""
+Async (ASGI) serving mode of the chat API, run it with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5050
+
+POST /messages is served natively: the chat memory is loaded and saved with async sessions and the support team is
+awaited, so a worker keeps serving other chats while the LLMs are answering. Every other route is served by the
+Flask app, mounted as a WSGI app.
+"""
+import asyncio
+import logging
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import memory
+from app import app as flask_app
+from auth import aget_user
+from bots.team import call_manager
+from db.aio import async_session
+from db.models import Org, OrgUser, User
+from settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+
+async def add_message(request: Request) -> JSONResponse:
+    # sessions are short-lived, no connection is held while the team is answering
+    async with async_session() as session:
+        await _authenticate(session, request)
+        body = await request.json()
+        Org.current.set(await session.scalar(_select_user_org(User.current.get().id)))
+        chat_memory = await memory.aload(session, body["chat_id"])
+
+    # the team searches the knowledge base through the Flask session
+    with flask_app.app_context():
+        # building the team of an org queries its tools and loads its prompts, the thread sees the app context
+        manager = await asyncio.to_thread(call_manager, chat_memory)
+        user_message = body["user_message"]
+        team_response = (await manager.ainvoke({"input": user_message}))["output"]
+
+    async with async_session() as session:
+        await memory.asave(session, body["chat_id"], user_message, team_response)
+
+    logger.info(f"User message: {user_message} \n Support team response: {team_response}")
+
+    response = body.copy()
+    response["assistant"] = team_response
+    return JSONResponse(response)
+
+
+async def _authenticate(session: AsyncSession, request: Request) -> None:
+    jwt = request.headers.get('Authorization')
+    if not jwt:
+        raise HTTPException(status_code=401)
+    user = await aget_user(session, jwt.split()[1])
+    if user is None:
+        raise HTTPException(status_code=401)
+    User.current.set(user)
+
+
+def _select_user_org(user_id) -> Select:
+    return (
+        select(Org)
+        .join(OrgUser, OrgUser.org_id == Org.id)
+        .where(OrgUser.user_id == user_id)
+    )
+
+
+def create_app() -> Starlette:
+    return Starlette(
+        routes=[
+            Route("/messages", add_message, methods=["POST"]),
+            Mount("/", app=WSGIMiddleware(flask_app)),
+        ],
+        middleware=[
+            Middleware(CORSMiddleware,
+                       allow_origins=app_settings.CORS_ORIGINS.split(","),
+                       allow_methods=app_settings.CORS_ALLOW_METHODS,
+                       allow_headers=["*"],
+                       expose_headers=app_settings.CORS_EXPOSE_HEADERS),
+        ],
+    )
+
+
+app = create_app()
@@ -1,6 +1,11 @@
-from .auth_bearer import AuthBearer, get_current_user
+from .jwt_token_handler import UserIdentity, create_access_token, decode_access_token, verify_token
+from .users import aget_user, get_user
 
 __all__ = [
-    "AuthBearer",
-    "get_current_user",
+    "UserIdentity",
+    "aget_user",
+    "create_access_token",
+    "decode_access_token",
+    "get_user",
+    "verify_token",
 ]
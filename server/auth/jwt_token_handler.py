@@ -1,13 +1,19 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
+from uuid import UUID
 
 from jose import jwt
 from jose.exceptions import JWTError
 
-from modules.user.entity.user_identity import UserIdentity
 from settings import app_settings
 
 
+class UserIdentity(NamedTuple):
+    id: UUID
+    email: Optional[str]
+    expires_at: Optional[datetime]
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -29,9 +35,15 @@ def decode_access_token(token: str) -> UserIdentity | None:
     except JWTError:
         return  # pyright: ignore reportPrivateUsage=none
 
+    try:
+        user_id = UUID(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+    expires_at = datetime.utcfromtimestamp(payload["exp"]) if "exp" in payload else None
     return UserIdentity(
         email=payload.get("email"),
-        id=payload.get("sub"),  # pyright: ignore reportPrivateUsage=none
+        id=user_id,  # pyright: ignore reportPrivateUsage=none
+        expires_at=expires_at,
     )
 
 
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from gotrue.errors import AuthApiError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from supabase import Client, create_client
+
+from auth.jwt_token_handler import UserIdentity, decode_access_token
+from db import db
+from db.models import User
+from settings import app_settings
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# detached snapshots of the users keyed by their access token, merged into the session of each request
+_users: LRUCache[str, User] = LRUCache(maxsize=app_settings.AUTH_CACHE_SIZE, ttl=app_settings.AUTH_CACHE_TTL)
+_supabase_client: Optional[Client] = None
+
+
+def get_user(token: str) -> Optional[User]:
+    """Resolve the user of a Supabase access token, None when the token is invalid or the user doesn't exist
+
+    The token is verified locally with the JWT secret of the project. Asking Supabase instead is an opt-in fallback
+    (AUTH_REMOTE_FALLBACK) for tokens that can't be verified locally.
+    """
+    cached = _users.get(token)
+    if cached is not None:
+        # no query: the snapshot becomes a persistent instance of this request's session as is
+        return db.session.merge(cached, load=False)
+
+    identity = decode_access_token(token)
+    if identity is None and app_settings.AUTH_REMOTE_FALLBACK:
+        identity = _get_remote_identity(token)
+    if identity is None:
+        return None
+
+    user = db.session.get(User, identity.id)
+    if user is None:
+        logger.warning(f"Valid token of an unknown user {identity.id}")
+        return None
+
+    _cache_user(token, user, identity)
+    return user
+
+
+async def aget_user(session: AsyncSession, token: str) -> Optional[User]:
+    """Async version of `get_user`, for the ASGI serving mode, sharing the same cache"""
+    cached = _users.get(token)
+    if cached is not None:
+        return await session.merge(cached, load=False)
+
+    identity = decode_access_token(token)
+    if identity is None and app_settings.AUTH_REMOTE_FALLBACK:
+        identity = await asyncio.to_thread(_get_remote_identity, token)
+    if identity is None:
+        return None
+
+    user = await session.get(User, identity.id)
+    if user is None:
+        logger.warning(f"Valid token of an unknown user {identity.id}")
+        return None
+
+    _cache_user(token, user, identity)
+    return user
+
+
+def _cache_user(token: str, user: User, identity: UserIdentity) -> None:
+    snapshot = User(id=user.id, email=user.email)
+    make_transient_to_detached(snapshot)
+    _users.set(token, snapshot, ttl=_cache_ttl(identity))
+
+
+def _cache_ttl(identity: UserIdentity) -> float:
+    # never serve a token from the cache after it expired
+    ttl = app_settings.AUTH_CACHE_TTL
+    if identity.expires_at is not None:
+        ttl = min(ttl, (identity.expires_at - datetime.utcnow()).total_seconds())
+    return max(ttl, 0)
+
+
+def _get_remote_identity(token: str) -> Optional[UserIdentity]:
+    global _supabase_client
+    if _supabase_client is None:
+        _supabase_client = create_client(app_settings.SUPABASE_URL, app_settings.SUPABASE_KEY)
+    try:
+        user_response = _supabase_client.auth.get_user(token)
+    except AuthApiError:
+        return None
+    if user_response is None:
+        return None
+    return UserIdentity(id=UUID(user_response.user.id), email=user_response.user.email, expires_at=None)
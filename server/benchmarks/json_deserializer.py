@@ -0,0 +1,60 @@
+"""
+Per-row cost of the JSON deserializer of the database engine on retrieval queries.
+
+A retrieval loads `top_k` chunks, each `Chunk.data` being a serialized LlamaIndex node. Compares the previous
+deserializer (rapidjson with the `from_serializable` hook on every dict) with `json_loads`. Run it from `server/`:
+
+    python -m benchmarks.json_deserializer
+"""
+import argparse
+import random
+import string
+import timeit
+
+import rapidjson
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+from utils.json import from_serializable, json_dumps, json_loads
+
+
+def _chunk_data(text_size: int) -> str:
+    """`Chunk.data` of a crawled page chunk, as the database returns it"""
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for _ in range(text_size // 6)]
+    node = TextNode(
+        text=" ".join(words)[:text_size],
+        metadata={"URL": "https://docs.example.com/guides/getting-started", "title": "Getting started"},
+        relationships={
+            NodeRelationship.SOURCE: RelatedNodeInfo(node_id="source", metadata={"URL": "https://docs.example.com"}),
+            NodeRelationship.PREVIOUS: RelatedNodeInfo(node_id="previous"),
+            NodeRelationship.NEXT: RelatedNodeInfo(node_id="next"),
+        },
+    )
+    return json_dumps(node_to_metadata_dict(node, remove_text=False, flat_metadata=False))
+
+
+def _previous_json_loads(s: str):
+    return rapidjson.loads(s, object_hook=from_serializable)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10, help="chunks per retrieval")
+    parser.add_argument("--text-size", type=int, default=2000, help="characters of text per chunk")
+    parser.add_argument("--repeat", type=int, default=2000, help="retrievals per measure")
+    args = parser.parse_args()
+
+    rows = [_chunk_data(args.text_size) for _ in range(args.rows)]
+    assert [json_loads(row) for row in rows] == [_previous_json_loads(row) for row in rows]
+
+    results = {}
+    for name, loads in [("from_serializable hook", _previous_json_loads), ("json_loads", json_loads)]:
+        seconds = min(timeit.repeat(lambda: [loads(row) for row in rows], number=args.repeat, repeat=5))
+        results[name] = seconds / (args.repeat * args.rows) * 1e6
+        print(f"{name:>24}: {results[name]:.2f} µs per row")
+    saving = results["from_serializable hook"] - results["json_loads"]
+    print(f"{'saving':>24}: {saving:.2f} µs per row, {saving / results['from_serializable hook']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import queue
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+
+class TokenQueueCallbackHandler(BaseCallbackHandler):
+    """Put the tokens of the tagged chat models into a queue, as they are produced
+
+    The handler is inherited by every run of the agent (tools, sub-agents), so the runs of the chat models to stream
+    are told apart by their tag, the tokens of the other ones are dropped.
+    """
+
+    def __init__(self, tokens: queue.Queue, tag: str):
+        self.tokens = tokens
+        self.tag = tag
+        self._streamed_runs: Set[UUID] = set()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID,
+                            tags: Optional[List[str]] = None, **kwargs: Any) -> None:
+        if tags and self.tag in tags:
+            self._streamed_runs.add(run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        # function calls of the agent stream with an empty content
+        if token and run_id in self._streamed_runs:
+            self.tokens.put(token)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._streamed_runs.discard(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._streamed_runs.discard(run_id)
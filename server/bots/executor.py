@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from flask import current_app, has_app_context
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from langchain_core.tools import BaseTool
+
+# pool of the step being run, `_perform_agent_action` submits the tool calls to it
+_tool_pool: ContextVar[Optional[ContextThreadPoolExecutor]] = ContextVar("tool_pool", default=None)
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """Agent executor running the tool calls the model asked for in one step concurrently
+
+    The observations are returned in the order of the calls, as the sequential executor does. Each call runs in its
+    own Flask app context, hence with its own database session: sessions can't be shared between threads. The async
+    interface of the agent executor already gathers the tool calls of a step.
+    """
+
+    max_parallel_tools: int = 4
+
+    def _iter_next_step(
+            self,
+            name_to_tool_map: Dict[str, BaseTool],
+            color_mapping: Dict[str, str],
+            inputs: Dict[str, str],
+            intermediate_steps: List[Tuple[AgentAction, str]],
+            run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Iterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        with ContextThreadPoolExecutor(max_workers=self.max_parallel_tools) as pool:
+            token = _tool_pool.set(pool)
+            try:
+                # draining the step submits all of its tool calls before waiting for any of them
+                outputs = list(super()._iter_next_step(
+                    name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+                ))
+            finally:
+                _tool_pool.reset(token)
+            for output in outputs:
+                yield output.result() if isinstance(output, Future) else output
+
+    def _perform_agent_action(
+            self,
+            name_to_tool_map: Dict[str, BaseTool],
+            color_mapping: Dict[str, str],
+            agent_action: AgentAction,
+            run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Union[AgentStep, Future]:
+        pool = _tool_pool.get()
+        if pool is None:
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        return pool.submit(_in_app_context, super()._perform_agent_action,
+                           name_to_tool_map, color_mapping, agent_action, run_manager)
+
+
+def _in_app_context(func, *args):
+    if not has_app_context():
+        return func(*args)
+    with current_app.app_context():
+        return func(*args)
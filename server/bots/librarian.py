@@ -24,7 +24,9 @@ from langchain.prompts import MessagesPlaceholder
 from langchain.schema import SystemMessage
 from langchain_community.chat_models import ChatOpenAI
 
-from vdb.utils import archive_text, archive_urls, search_knowledge_base
+from db.models import IngestionJob
+from vdb import jobs
+from vdb.utils import search_knowledge_base
 from settings import app_settings
 
 SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -73,12 +75,12 @@ def librarian_agent():
     tools = [
         Tool(
             name="Archive_text_data",
-            func=archive_text,
+            func=enqueue_text,
             description="Store text data in the knowledge base."
         ),
         Tool(
             name="Archive_URLs",
-            func=archive_urls,
+            func=enqueue_urls,
             description="Scan provided URLs for text data and save it in the knowledge base."
         ),
         Tool(
@@ -100,6 +102,19 @@ def librarian_agent():
     return agent
 
 
+def enqueue_text(text: str) -> str:
+    return _queued(jobs.enqueue("text", text=text))
+
+
+def enqueue_urls(urls: str) -> str:
+    return _queued(jobs.enqueue("urls", urls=[url.strip() for url in urls.split(";") if url.strip()]))
+
+
+def _queued(job: IngestionJob) -> str:
+    # archiving runs in the background, see worker.py
+    return f"Archiving job {job.id} is queued, the data will be in the knowledge base once it is done."
+
+
 if __name__ == '__main__':
     while True:
         user_input = input('>>> ')
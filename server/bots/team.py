@@ -8,20 +8,28 @@ from __future__ import annotations
 import logging
 from functools import wraps
 from operator import itemgetter
+from typing import NamedTuple, Optional
+from uuid import UUID
 
-from langchain.agents import AgentType, Tool, initialize_agent, AgentExecutor
+from langchain.agents import Tool, AgentExecutor, OpenAIFunctionsAgent, create_openai_tools_agent
+from langchain.agents.agent import RunnableMultiActionAgent
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import MessagesPlaceholder
 from langchain.prompts import PromptTemplate
 from langchain.schema import StrOutputParser, SystemMessage
-from langchain.schema.runnable import RunnableSerializable, RunnablePassthrough
-from langchain_core.tools import StructuredTool
+from langchain.schema.runnable import Runnable, RunnableConfig, RunnableLambda, RunnableSerializable, \
+    RunnablePassthrough
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.tools import BaseTool, StructuredTool
 from langchain_openai.chat_models import ChatOpenAI
 from pydantic.v1 import BaseModel, Field
 
+from bots.executor import ParallelAgentExecutor
 from db.models import Org
+from vdb import answer_cache
 from vdb.retriever import LlamaVectorIndexRetriever, format_docs
-from settings import app_settings, read_prompts_to_dict
+from settings import app_settings, prompts_signature, read_prompts_to_dict
+from utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -35,11 +43,89 @@ def chain_to_tool(chain):
     return decorated_function
 
 
+def achain_to_tool(chain):
+    @wraps(chain)
+    async def decorated_function(**kwargs):
+        # convert kwargs to a dict
+        return await chain(kwargs)
+
+    return decorated_function
+
+
+class _Team(NamedTuple):
+    """The parts of an org support team that don't depend on the chat, built once and shared between messages"""
+    signature: tuple
+    manager: RunnableMultiActionAgent
+    tools: list[BaseTool]
+    issuer: RunnableMultiActionAgent
+    issuer_tools: list[BaseTool]
+
+
+_teams: LRUCache[UUID, _Team] = LRUCache(maxsize=app_settings.AGENT_CACHE_SIZE)
+
+MANAGER_TAG = "manager"
+ISSUER_TOOL_NAME = "Issues_assistant"
+ISSUER_TOOL_DESCRIPTION = "When the query of the customer is related to a bug, a problem or any difficulty that he is struggling with.\nHow to interact: Provide the information of what problem does the customer has with the context of previous advice and help that you provided to the customer and what customer has already tried to solve it. It is important for you both to not repeat same questions/advices to the customer. Also try not to ask more than 5 questions in one message."
+
+
 def call_manager(memory: ConversationBufferWindowMemory) -> AgentExecutor:
     """
     Call your best man: Customer Support Manager. He knows how to resolve any issue, and find the proper solution to any
     problem with the help of his crew.
+
+    The crew of the current org is cached, only the chat memory and the issuer's own memory are bound per call.
     """
+    team = _get_team(Org.current.get())
+    issuer_memory = ConversationBufferWindowMemory(k=5, memory_key="memory", return_messages=True)
+    issuer = _executor(team.issuer, team.issuer_tools, issuer_memory)
+    tools = [
+        Tool.from_function(func=issuer.invoke, coroutine=issuer.ainvoke, name=ISSUER_TOOL_NAME,
+                           description=ISSUER_TOOL_DESCRIPTION)
+        if tool.name == ISSUER_TOOL_NAME else tool
+        for tool in team.tools
+    ]
+    return _executor(team.manager, tools, memory)
+
+
+def _executor(agent: RunnableMultiActionAgent, tools: list[BaseTool],
+              memory: ConversationBufferWindowMemory) -> AgentExecutor:
+    # the tool calls the model asks for in one step run concurrently
+    return ParallelAgentExecutor(agent=agent, tools=tools, memory=memory, verbose=True,
+                                 max_parallel_tools=app_settings.AGENT_MAX_PARALLEL_TOOLS)
+
+
+def _create_agent(llm: ChatOpenAI, tools: list[BaseTool], system_message: SystemMessage) -> RunnableMultiActionAgent:
+    """OpenAI tools agent, it may ask for several tool calls at once, unlike the functions agent"""
+    prompt = OpenAIFunctionsAgent.create_prompt(
+        system_message=system_message,
+        extra_prompt_messages=[
+            MessagesPlaceholder(variable_name="memory")
+        ],
+    )
+    return RunnableMultiActionAgent(runnable=create_openai_tools_agent(llm, tools, prompt),
+                                    input_keys_arg=["input"], return_keys_arg=["output"])
+
+
+def invalidate_team(org_id: Optional[UUID] = None) -> None:
+    """Drop the cached team of the org, or of all orgs, the next message rebuilds it"""
+    if org_id is None:
+        _teams.clear()
+    else:
+        _teams.pop(org_id)
+
+
+def _get_team(org: Org) -> _Team:
+    # the prompt files are stat-ed on every call, so that an edited prompt is picked up without a restart
+    signature = prompts_signature(org.name)
+    team = _teams.get(org.id)
+    if team is None or team.signature != signature:
+        logger.info(f"Building the support team of the org {org.name}")
+        team = _build_team(org.name, signature)
+        _teams.set(org.id, team)
+    return team
+
+
+def _build_team(org_name: str, signature: tuple) -> _Team:
     # TODO: need to wrap this in LangSmith client to enable logging
     # import openai
     # from langsmith.wrappers import wrap_openai
@@ -47,56 +133,62 @@ def call_manager(memory: ConversationBufferWindowMemory) -> AgentExecutor:
     #   client = wrap_openai(openai.Client())
     # llm = client.chat.completions.create(temperature=0, model=app_settings.GPT_4)
 
+    # the manager streams, so that its answer can be forwarded token by token, see TokenQueueCallbackHandler
     llm = ChatOpenAI(temperature=0,
                      model=app_settings.GPT_4,
-                     openai_api_key=app_settings.OPENAI_API_KEY)
-    org_prompts = read_prompts_to_dict(Org.current.get().name)
-    system_message = SystemMessage(content=org_prompts['manager'])
+                     openai_api_key=app_settings.OPENAI_API_KEY,
+                     streaming=True,
+                     tags=[MANAGER_TAG])
+    assistant_llm = ChatOpenAI(temperature=0,
+                               model=app_settings.GPT_35,
+                               openai_api_key=app_settings.OPENAI_API_KEY)
+    org_prompts = read_prompts_to_dict(org_name)
+    knowledge_chain = retrieval_chain(org_prompts, assistant_llm)
+    feedback = feedback_chain(org_prompts, assistant_llm)
+    human = switch_to_human_chain(org_prompts, assistant_llm)
+    finisher = fatality_chain(org_prompts, assistant_llm)
 
     tools = [
         StructuredTool.from_function(
-            func=chain_to_tool(retrieval_chain(org_prompts).invoke),
+            func=chain_to_tool(knowledge_chain.invoke),
+            coroutine=achain_to_tool(knowledge_chain.ainvoke),
             name="Product_Knowledge_Assistant",
             description="When the query of the customer is related to the product knowledge and any details about it.",
             args_schema=RetrievalChainInput,
         ),
         Tool.from_function(
-            func=feedback_chain(org_prompts).invoke,
+            func=feedback.invoke,
+            coroutine=feedback.ainvoke,
             name="Feedback_assistant",
             description="When the query if the customer is related to the feedback, improvements or feature request.\nHow to interact: Provide the details of the customer's query and if this is not the first iteration of the feedback, make sure to provide a context that was already been discussed with the customer to not repeat the same things.",
         ),
+        # placeholder, call_manager swaps in an issuer with its own memory
         Tool.from_function(
-            func=get_agent_issuer(org_prompts).invoke,
-            name="Issues_assistant",
-            description="When the query of the customer is related to a bug, a problem or any difficulty that he is struggling with.\nHow to interact: Provide the information of what problem does the customer has with the context of previous advice and help that you provided to the customer and what customer has already tried to solve it. It is important for you both to not repeat same questions/advices to the customer. Also try not to ask more than 5 questions in one message.",
+            func=_unbound_issuer,
+            name=ISSUER_TOOL_NAME,
+            description=ISSUER_TOOL_DESCRIPTION,
         ),
         Tool.from_function(
-            func=switch_to_human_chain(org_prompts).invoke,
+            func=human.invoke,
+            coroutine=human.ainvoke,
             name="Switch_to_human_assistant",
             description="When the customer wants to transfer the request to the human or you decide it yourself because this is the only solution.\nHow to interact: Provide the details about the status of the conversation and the level of satisfaction and mood level of the client at this moment.",
         ),
         Tool.from_function(
-            func=fatality_chain(org_prompts).invoke,
+            func=finisher.invoke,
+            coroutine=finisher.ainvoke,
             name="Conversation_finisher",
             description="When you need to manage all types of conversation endings with the customer.\nHow to interact with this team member: Tell that the customer is ready to finish the conversation and provide his satisfaction level, mood level and the current conversation status.",
         )
     ]
+    issuer, issuer_tools = get_agent_issuer(org_prompts, assistant_llm, knowledge_chain)
 
-    agent_kwargs = {
-        "system_message": system_message,
-        "extra_prompt_messages": [
-            MessagesPlaceholder(variable_name="memory")
-        ],
-    }
-
-    return initialize_agent(
-        tools,
-        llm,
-        agent=AgentType.OPENAI_FUNCTIONS,
-        verbose=True,
-        agent_kwargs=agent_kwargs,
-        memory=memory,
-    )
+    manager = _create_agent(llm, tools, SystemMessage(content=org_prompts['manager']))
+    return _Team(signature, manager, tools, issuer, issuer_tools)
+
+
+def _unbound_issuer(query: str) -> str:
+    raise RuntimeError("The issuer is bound per call, use call_manager to get the support team")
 
 
 class RetrievalChainInput(BaseModel):
@@ -104,19 +196,16 @@ class RetrievalChainInput(BaseModel):
     query: str = Field(description="keyword search query")
 
 
-def retrieval_chain(prompts: dict[str, str]):
+def retrieval_chain(prompts: dict[str, str], llm: ChatOpenAI):
     """
     Product knowledge assistant.
     Retrieve relevant documents from the knowledge base and produce the response based on that context.
     """
 
     prompt = PromptTemplate.from_template(prompts['product_knowledge'])
-    retriever = LlamaVectorIndexRetriever(metadata={"current_org": Org.current.get()})
+    retriever = LlamaVectorIndexRetriever()
 
-    llm = ChatOpenAI(temperature=0,
-                     openai_api_key=app_settings.OPENAI_API_KEY,
-                     model_name=app_settings.GPT_35)
-    return (
+    chain = (
             {
                 "query": itemgetter("user_question"),
                 "context": itemgetter("query") | retriever | format_docs,
@@ -125,18 +214,42 @@ def retrieval_chain(prompts: dict[str, str]):
             | llm
             | StrOutputParser()
     )
+    return with_answer_cache(chain, prompts['product_knowledge'])
+
+
+def with_answer_cache(chain: Runnable, prompt: str) -> Runnable:
+    """
+    Answer with the cached answer of a close enough question of the org, run the chain and cache its answer otherwise.
+    """
+    if not answer_cache.is_enabled():
+        return chain
+    prompt_hash = answer_cache.prompt_hash(prompt)
 
+    def invoke(inputs: dict, config: RunnableConfig) -> str:
+        answer = answer_cache.lookup(inputs["user_question"], prompt_hash)
+        if answer is None:
+            answer = chain.invoke(inputs, config)
+            answer_cache.store(inputs["user_question"], prompt_hash, answer)
+        return answer
 
-def feedback_chain(prompts: dict[str, str]) -> RunnableSerializable[str, str]:
+    async def ainvoke(inputs: dict, config: RunnableConfig) -> str:
+        # the cache is synchronous, keep it off the event loop
+        answer = await run_in_executor(config, answer_cache.lookup, inputs["user_question"], prompt_hash)
+        if answer is None:
+            answer = await chain.ainvoke(inputs, config)
+            await run_in_executor(config, answer_cache.store, inputs["user_question"], prompt_hash, answer)
+        return answer
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="answer_cache")
+
+
+def feedback_chain(prompts: dict[str, str], llm: ChatOpenAI) -> RunnableSerializable[str, str]:
     """
     Feedback assistant. Deals with any feedback type queries from the customer.
     """
 
     prompt = PromptTemplate.from_template(prompts['feedback'])
 
-    llm = ChatOpenAI(temperature=0,
-                     openai_api_key=app_settings.OPENAI_API_KEY,
-                     model_name=app_settings.GPT_35)
     return (
             {
                 "query": RunnablePassthrough()
@@ -147,52 +260,34 @@ def feedback_chain(prompts: dict[str, str]) -> RunnableSerializable[str, str]:
     )
 
 
-def get_agent_issuer(prompts: dict[str, str]) -> AgentExecutor:
+def get_agent_issuer(prompts: dict[str, str], llm: ChatOpenAI,
+                     knowledge_chain: Runnable) -> tuple[RunnableMultiActionAgent, list[BaseTool]]:
     """
     Issuer. Deals with any types of customers' problems.
+    Returns the agent and its tools, the executor with its memory is created per call.
     """
-    memory = ConversationBufferWindowMemory(k=5, memory_key="memory", return_messages=True)
-    llm = ChatOpenAI(temperature=0,
-                     model=app_settings.GPT_35,
-                     openai_api_key=app_settings.OPENAI_API_KEY)
     system_message = SystemMessage(content=prompts['issuer'])
 
     tools = [
         StructuredTool.from_function(
-            func=chain_to_tool(retrieval_chain(prompts).invoke),
+            func=chain_to_tool(knowledge_chain.invoke),
+            coroutine=achain_to_tool(knowledge_chain.ainvoke),
             name="Product_Knowledge_Assistant",
             description="When you need to retrieve the information from the product knowledge base",
             args_schema=RetrievalChainInput,
         )
     ]
 
-    agent_kwargs = {
-        "system_message": system_message,
-        "extra_prompt_messages": [
-            MessagesPlaceholder(variable_name="memory")
-        ],
-    }
-
-    return initialize_agent(
-        tools,
-        llm,
-        agent=AgentType.OPENAI_FUNCTIONS,
-        verbose=True,
-        agent_kwargs=agent_kwargs,
-        memory=memory,
-    )
+    return _create_agent(llm, tools, system_message), tools
 
 
-def switch_to_human_chain(prompts: dict[str, str]) -> RunnableSerializable[str, str]:
+def switch_to_human_chain(prompts: dict[str, str], llm: ChatOpenAI) -> RunnableSerializable[str, str]:
     """
     Switch to human. Allows transfer requests and support to the internal team.
     """
 
     prompt = PromptTemplate.from_template(prompts['human'])
 
-    llm = ChatOpenAI(temperature=0,
-                     openai_api_key=app_settings.OPENAI_API_KEY,
-                     model_name=app_settings.GPT_35)
     return (
             {
                 "query": RunnablePassthrough()
@@ -203,16 +298,13 @@ def switch_to_human_chain(prompts: dict[str, str]) -> RunnableSerializable[str,
     )
 
 
-def fatality_chain(prompts: dict[str, str]) -> RunnableSerializable[str, str]:
+def fatality_chain(prompts: dict[str, str], llm: ChatOpenAI) -> RunnableSerializable[str, str]:
     """
     Conversation finisher. Knows how to make a nice end to the conversation.
     """
 
     prompt = PromptTemplate.from_template(prompts['finisher'])
 
-    llm = ChatOpenAI(temperature=0,
-                     openai_api_key=app_settings.OPENAI_API_KEY,
-                     model_name=app_settings.GPT_35)
     return (
             {
                 "query": RunnablePassthrough()
@@ -0,0 +1,21 @@
+"""
+Async access to the database, used by the ASGI serving mode (see asgi.py).
+
+The models are shared with the Flask app, only the engine and the sessions differ: psycopg 3 drives the async engine,
+sessions are short-lived and opened explicitly, so that no connection is held while the LLMs are answering.
+"""
+from __future__ import annotations
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from db import ENGINE_ARGUMENTS, SESSION_ARGUMENTS
+from settings import app_settings
+
+
+def _async_url(url: str) -> str:
+    return make_url(url).set(drivername="postgresql+psycopg").render_as_string(hide_password=False)
+
+
+engine = create_async_engine(_async_url(app_settings.SQLALCHEMY_DATABASE_URI), **ENGINE_ARGUMENTS)
+async_session: async_sessionmaker[AsyncSession] = async_sessionmaker(engine, **SESSION_ARGUMENTS)
@@ -3,19 +3,25 @@ from __future__ import annotations
 
 from contextvars import ContextVar
 from datetime import datetime
-from typing import Any
+from functools import cache
+from typing import Any, NamedTuple, Optional, Union
+from uuid import UUID
 
 from llama_index.core.constants import DEFAULT_EMBEDDING_DIM
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
 from sqlalchemy import String, UniqueConstraint, Boolean, \
-    DateTime, Text
-from sqlalchemy import select
-from sqlalchemy.dialects.postgresql import JSON
-from sqlalchemy.orm import Mapped
+    DateTime, Text, Integer, Index, Computed, Float, Table
+from sqlalchemy import ColumnElement, Select, cast, func, literal, select
+from sqlalchemy.dialects.postgresql import JSONB, TSQUERY, TSVECTOR
+from sqlalchemy.orm import Mapped, Session
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
 
 from db import db, ForeignKeyCascade
+from settings import app_settings
+
+# text search configuration of the chunk full-text index
+TS_CONFIG = "english"
 
 
 class User(db.Model):
@@ -31,20 +37,142 @@ class User(db.Model):
 
 class Org(db.Model):
     name: Mapped[str] = mapped_column(String(30))
+    # per-org ANN index tuning, NULL means fallback to the app settings
+    ef_search: Mapped[Optional[int]] = mapped_column(Integer)
+    probes: Mapped[Optional[int]] = mapped_column(Integer)
+    # embedding model of the org's chunks and questions, see vdb.reembed to change it
+    embedding_model: Mapped[str] = mapped_column(String(100), default=lambda: app_settings.EMBEDDING_MODEL)
+    embedding_dim: Mapped[int] = mapped_column(Integer, default=lambda: app_settings.EMBEDDING_DIM)
+    # model of the chunks' next_embedding while they are re-embedded, NULL otherwise
+    next_embedding_model: Mapped[Optional[str]] = mapped_column(String(100))
+    next_embedding_dim: Mapped[Optional[int]] = mapped_column(Integer)
     # relationships
     chunks = relationship("Chunk", backref="org")
+    sources = relationship("Source", backref="org")
     org_users = relationship("OrgUser", backref="org")
 
     # Not a column
     current: ContextVar[Org] = ContextVar('current_org')
 
-    def similarity_search(self, embedding: list[float], k: int = 10) -> list[tuple[Chunk, float]]:
-        """Search for similar chunks in this org"""
-        q = select(Chunk, 1 - Chunk.embedding.cosine_distance(embedding)). \
-            where(Chunk.org_id == self.id). \
-            order_by(Chunk.embedding.cosine_distance(embedding)). \
+    def hybrid_search(self, embedding: list[float], query: str, k: int = 10, candidates: int = 40,
+                      ef_search: Optional[int] = None, probes: Optional[int] = None,
+                      where: Optional[ColumnElement[bool]] = None,
+                      projected: bool = False) -> list[tuple[Union[Chunk, ChunkText], float]]:
+        """Search for chunks similar to the embedding or containing the words of the query in this org
+
+        The `candidates` best chunks of the vector search and of the full-text search are fused with reciprocal rank
+        fusion, in a single query, so exact product names or error codes rank well. The score is the fused one.
+        `where` and `projected` are the ones of `similarity_search`.
+        """
+        self._set_search_params(ef_search, probes)
+        # limited before being ranked, so that the ANN index is used
+        vector_hits = _nearest_chunks(embedding, candidates, self._chunk_filters(where)).subquery()
+        vector_ranks = select(vector_hits.c.id,
+                              func.row_number().over(order_by=vector_hits.c.distance).label("rank")).subquery()
+
+        # any of the words matches, the rank favours the chunks with more of them
+        ts_query = func.replace(func.plainto_tsquery(TS_CONFIG, query).cast(Text), "&", "|").cast(TSQUERY)
+        text_rank = func.ts_rank_cd(Chunk.tsv, ts_query)
+        text_hits = select(Chunk.id, text_rank.label("text_rank")). \
+            where(Chunk.tsv.bool_op("@@")(ts_query), *self._chunk_filters(where)). \
+            order_by(text_rank.desc()). \
+            limit(candidates).subquery()
+        text_ranks = select(text_hits.c.id,
+                            func.row_number().over(order_by=text_hits.c.text_rank.desc()).label("rank")).subquery()
+
+        score = (func.coalesce(1.0 / (app_settings.VDB_RRF_K + vector_ranks.c.rank), 0.0) +
+                 func.coalesce(1.0 / (app_settings.VDB_RRF_K + text_ranks.c.rank), 0.0))
+        fused_id = func.coalesce(vector_ranks.c.id, text_ranks.c.id)
+        fused = select(fused_id.label("id"), score.cast(Float).label("score")). \
+            select_from(vector_ranks.join(text_ranks, vector_ranks.c.id == text_ranks.c.id, full=True)).subquery()
+        q = select(*_search_entities(projected), fused.c.score). \
+            join(fused, Chunk.id == fused.c.id). \
+            order_by(fused.c.score.desc()). \
             limit(k)
-        return list(map(tuple, db.session.execute(q).all()))
+        return _search_results(db.session.execute(q).all(), projected)
+
+    def similarity_search(self, embedding: list[float], k: int = 10, ef_search: Optional[int] = None,
+                          probes: Optional[int] = None,
+                          where: Optional[ColumnElement[bool]] = None,
+                          projected: bool = False) -> list[tuple[Union[Chunk, ChunkText], float]]:
+        """Search for similar chunks in this org
+
+        `ef_search` (HNSW) and `probes` (IVFFlat) trade recall for speed of the index scan. When not given, the
+        org's own values are used, then the app settings, then the pgvector defaults. `where` restricts the search
+        to the chunks matching it, it is applied during the index scan with `HNSW_ITERATIVE_SCAN` and not after it.
+        With `VDB_QUANTIZATION`, the quantized index is searched and its candidates re-ranked with the full vectors.
+        `projected` returns the text, URL and id of the chunks only, rather than the chunks and their whole nodes.
+        """
+        self._set_search_params(ef_search, probes)
+        hits = _nearest_chunks(embedding, k, self._chunk_filters(where)).subquery()
+        q = select(*_search_entities(projected), 1 - hits.c.distance). \
+            join(hits, Chunk.id == hits.c.id). \
+            order_by(hits.c.distance)
+        return _search_results(db.session.execute(q).all(), projected)
+
+    def _chunk_filters(self, where: Optional[ColumnElement[bool]]) -> list[ColumnElement[bool]]:
+        return [Chunk.org_id == self.id] if where is None else [Chunk.org_id == self.id, where]
+
+    def _set_search_params(self, ef_search: Optional[int], probes: Optional[int]) -> None:
+        set_vector_search_params({
+            "hnsw.ef_search": ef_search or self.ef_search or app_settings.HNSW_EF_SEARCH,
+            "hnsw.iterative_scan": app_settings.HNSW_ITERATIVE_SCAN,
+            "ivfflat.probes": probes or self.probes or app_settings.IVFFLAT_PROBES,
+        })
+
+
+class ChunkText(NamedTuple):
+    """What a search needs of a chunk to answer from it"""
+    id: UUID
+    text: str
+    url: Optional[str]
+
+
+def _nearest_chunks(embedding: list[float], k: int, filters: list[ColumnElement[bool]]) -> Select:
+    """Ids and cosine distances of the k chunks nearest to the embedding, nearest first"""
+    # the expressions of the indexes of the dimension, see `embedding_indexes`
+    dim = len(embedding)
+    filters = [*filters, dimension_filter(Chunk.embedding, dim)]
+    distance = Chunk.embedding.cast(Vector(dim)).cosine_distance(embedding)
+    if app_settings.VDB_QUANTIZATION is None:
+        return select(Chunk.id, distance.label("distance")).where(*filters).order_by(distance).limit(k)
+
+    if app_settings.VDB_QUANTIZATION == "halfvec":
+        quantized_distance = Chunk.embedding.cast(HALFVEC(dim)).cosine_distance(cast(embedding, HALFVEC(dim)))
+    else:
+        quantized_distance = func.binary_quantize(Chunk.embedding).cast(BIT(dim)).hamming_distance(
+            func.binary_quantize(cast(embedding, Vector(dim))).cast(BIT(dim))
+        )
+    candidates = select(Chunk.id). \
+        where(*filters). \
+        order_by(quantized_distance). \
+        limit(max(k, app_settings.VDB_RERANK_CANDIDATES))
+    return select(Chunk.id, distance.label("distance")). \
+        where(Chunk.id.in_(candidates.scalar_subquery())). \
+        order_by(distance). \
+        limit(k)
+
+
+def _search_entities(projected: bool) -> tuple:
+    if not projected:
+        return Chunk,
+    # the node text is the only part of the serialized node that is decoded, by the database
+    node_text = func.coalesce(Chunk.data["_node_content"].astext.cast(JSONB)["text"].astext, Chunk.data["text"].astext)
+    return Chunk.id, node_text, Chunk.data["URL"].astext
+
+
+def _search_results(rows: list, projected: bool) -> list[tuple[Union[Chunk, ChunkText], float]]:
+    if not projected:
+        return list(map(tuple, rows))
+    return [(ChunkText(*row[:-1]), row[-1]) for row in rows]
+
+
+def set_vector_search_params(params: dict[str, Any], session: Optional[Session] = None) -> None:
+    """Set pgvector query parameters for the current transaction only, in a single round-trip"""
+    params = {name: str(value) for name, value in params.items() if value is not None}
+    if params:
+        session = session or db.session
+        session.execute(select(*[func.set_config(name, value, True) for name, value in params.items()]))
 
 
 class OrgUser(db.Model):
@@ -53,16 +181,148 @@ class OrgUser(db.Model):
     org_id: Mapped[str] = mapped_column(ForeignKeyCascade(Org.id))
 
 
+class Source(db.Model):
+    # Document the chunks come from: web page URL or file path
+    __table_args__ = (
+        UniqueConstraint("org_id", "uri", name="org_uri_unique_together"),
+    )
+
+    org_id: Mapped[str] = mapped_column(ForeignKeyCascade(Org.id))
+    uri: Mapped[str] = mapped_column(Text)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow,
+                                                 onupdate=datetime.utcnow)
+
+    chunks = relationship("Chunk", secondary=lambda: ChunkSource.__table__, backref="sources", viewonly=True)
+
+
 class Chunk(db.Model):
     __table_args__ = (
         UniqueConstraint("org_id", "hash_value", name="org_hash_unique_together"),
+        Index("chunk_tsv_idx", "tsv", postgresql_using="gin"),
+        # metadata filters of the searches (containment), see vdb.filters
+        Index("chunk_data_idx", "data", postgresql_using="gin", postgresql_ops={"data": "jsonb_path_ops"}),
     )
 
     org_id: Mapped[str] = mapped_column(ForeignKeyCascade(Org.id))
 
-    data: Mapped[dict[str, Any]] = mapped_column(JSON)
+    data: Mapped[dict[str, Any]] = mapped_column(JSONB)
     hash_value: Mapped[str] = mapped_column(String(64))
-    embedding: Mapped[Vector] = mapped_column(Vector(DEFAULT_EMBEDDING_DIM))
+    # the dimension is the one of the org's embedding model, see `embedding_indexes`
+    embedding: Mapped[Vector] = mapped_column(Vector())
+    # embedding with the next model of the org while its chunks are re-embedded, see vdb.reembed
+    next_embedding: Mapped[Optional[Vector]] = mapped_column(Vector(), deferred=True)
+    # full-text index of the node text, LlamaIndex nodes keep it serialized in "_node_content"
+    tsv: Mapped[Any] = mapped_column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{TS_CONFIG}', "
+                 f"coalesce((data ->> '_node_content')::jsonb ->> 'text', data ->> 'text', ''))", persisted=True),
+        deferred=True,
+    )
+
+
+class ChunkSource(db.Model):
+    # Many-to-many between chunks and sources: a chunk is stored once per org, while a paragraph (footer, notice)
+    # may be repeated by several pages. A chunk is deleted once no source has it any more, see vdb.store
+    __table_args__ = (
+        UniqueConstraint("chunk_id", "source_id", name="chunk_source_unique_together"),
+        Index("ix_chunk_source_source_id", "source_id"),
+    )
+
+    chunk_id: Mapped[str] = mapped_column(ForeignKeyCascade(Chunk.id))
+    source_id: Mapped[str] = mapped_column(ForeignKeyCascade(Source.id))
+
+
+class CachedAnswer(db.Model):
+    # Answers of the product knowledge assistant, reused for semantically close questions of the org
+    __table_args__ = (
+        Index("cached_answer_org_id_created_at_idx", "org_id", "created_at"),
+    )
+
+    org_id: Mapped[str] = mapped_column(ForeignKeyCascade(Org.id))
+    prompt_hash: Mapped[str] = mapped_column(String(64))
+    question: Mapped[str] = mapped_column(Text)
+    answer: Mapped[str] = mapped_column(Text)
+    embedding: Mapped[Vector] = mapped_column(Vector())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+
+
+def dimension_filter(embedding_column, dim: int) -> ColumnElement[bool]:
+    """The embeddings of `dim` dimensions, the ones the partial indexes of the dimension serve"""
+    # rendered as a literal, the planner only uses a partial index when its predicate is implied by the query's
+    return func.vector_dims(embedding_column) == literal(dim, literal_execute=True)
+
+
+@cache
+def embedding_indexes(dim: int, quantization: Optional[str] = None, chunk_table: Optional[Table] = None,
+                      cached_answer_table: Optional[Table] = None) -> list[Index]:
+    """The HNSW indexes of the embeddings of `dim` dimensions searched with the quantization, see VDB_QUANTIZATION
+
+    The embedding columns have no fixed dimension, each org has its own embedding model. An index only covers one
+    dimension, so it is partial and on the embeddings cast to their dimension. A quantized search re-ranks with the
+    full vectors rather than an index of them, its chunk index replaces the full-precision one.
+    The indexes are added to the tables, the ones of the models by default.
+    """
+    chunk_table = Chunk.__table__ if chunk_table is None else chunk_table
+    cached_answer_table = CachedAnswer.__table__ if cached_answer_table is None else cached_answer_table
+    chunk_embedding, cached_answer_embedding = chunk_table.c.embedding, cached_answer_table.c.embedding
+
+    def hnsw_index(name: str, expression, ops: str, embedding_column) -> Index:
+        return Index(
+            name,
+            expression.label("expression"),
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"expression": ops},
+            postgresql_where=func.vector_dims(embedding_column) == dim,
+        )
+
+    name = chunk_embedding_index_name(dim, quantization)
+    if quantization is None:
+        # Approximate nearest-neighbour index. The org filter is applied during the graph walk with iterative index
+        # scans (HNSW_ITERATIVE_SCAN), while small orgs are served by the (org_id, hash_value) index with an exact scan
+        chunk_index = hnsw_index(name, chunk_embedding.cast(Vector(dim)), "vector_cosine_ops", chunk_embedding)
+    elif quantization == "halfvec":
+        chunk_index = hnsw_index(name, chunk_embedding.cast(HALFVEC(dim)), "halfvec_cosine_ops", chunk_embedding)
+    else:
+        chunk_index = hnsw_index(name, func.binary_quantize(chunk_embedding).cast(BIT(dim)), "bit_hamming_ops",
+                                 chunk_embedding)
+    return [
+        chunk_index,
+        hnsw_index(f"cached_answer_embedding_{dim}_hnsw_idx", cached_answer_embedding.cast(Vector(dim)),
+                   "vector_cosine_ops", cached_answer_embedding),
+    ]
+
+
+def chunk_embedding_index_name(dim: int, quantization: Optional[str] = None) -> str:
+    suffix = {None: "", "halfvec": "_halfvec", "binary": "_bit"}[quantization]
+    return f"chunk_embedding_{dim}{suffix}_hnsw_idx"
+
+
+for _dim in {DEFAULT_EMBEDDING_DIM, app_settings.EMBEDDING_DIM}:
+    embedding_indexes(_dim, app_settings.VDB_QUANTIZATION)
+
+
+class IngestionJob(db.Model):
+    # Background archiving of URLs, files or text in the knowledge base of an org, see vdb.jobs
+    __table_args__ = (
+        Index("ingestion_job_status_run_after_idx", "status", "run_after"),
+        Index("ingestion_job_org_id_status_idx", "org_id", "status"),
+    )
+
+    org_id: Mapped[str] = mapped_column(ForeignKeyCascade(Org.id))
+    kind: Mapped[str] = mapped_column(String(16))  # "urls", "files" or "text"
+    params: Mapped[dict[str, Any]] = mapped_column(JSONB)
+    status: Mapped[str] = mapped_column(String(16), default="queued")  # "running", "succeeded" or "failed"
+    progress: Mapped[Optional[str]] = mapped_column(Text)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+    run_after: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    # refreshed by the worker running the job, a job whose heartbeat stopped is run again
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
 
 
 class Chat(db.Model):
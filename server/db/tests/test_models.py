@@ -1,12 +1,16 @@
+from unittest.mock import patch
 from uuid import uuid4
 
 import pytest
 from llama_index.core.constants import DEFAULT_EMBEDDING_DIM
-from sqlalchemy import exc, select
+from sqlalchemy import MetaData, exc, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
 
 from db import db
-from db.models import Chunk, Org, User
+from db.models import CachedAnswer, Chunk, ChunkText, Org, User, embedding_indexes
 from db.tests.factories import OrgFactory, UserFactory, ChunkFactory, OrgUserFactory
+from settings import app_settings
 
 
 class TestBase:
@@ -48,6 +52,79 @@ class TestOrg:
         assert chunks_with_similarities[0] == (expected_chunks[0], 1.0)
         assert all(chunks_with_similarities[i][1] == 0.0 for i in range(1, 5))
 
+    def test_similarity_search_search_params(self):
+        org = OrgFactory.create(name='test company', ef_search=80)
+        embedding = [0] * DEFAULT_EMBEDDING_DIM
+        embedding[0] = 100
+        chunk = ChunkFactory.create(org=org, data={"text": "Chunk"}, embedding=embedding)
+
+        org_tuned = org.similarity_search(embedding)
+        assert db.session.execute(text("SHOW hnsw.ef_search")).scalar_one() == "80"
+
+        call_tuned = org.similarity_search(embedding, ef_search=200, probes=5)
+        assert db.session.execute(text("SHOW hnsw.ef_search")).scalar_one() == "200"
+        assert db.session.execute(text("SHOW ivfflat.probes")).scalar_one() == "5"
+
+        assert org_tuned == call_tuned == [(chunk, 1.0)]
+
+    @pytest.mark.parametrize("quantization", ["halfvec", "binary"])
+    def test_similarity_search_quantized(self, quantization):
+        org = OrgFactory.create(name='test company')
+        chunks = []
+        for i in range(5):
+            embedding = [1] * DEFAULT_EMBEDDING_DIM
+            embedding[i] = -1
+            chunks.append(ChunkFactory.create(org=org, data={"text": f"Chunk {i}"}, embedding=embedding))
+        search_embedding = [1] * DEFAULT_EMBEDDING_DIM
+        search_embedding[2] = -1
+
+        with patch.object(app_settings, "VDB_QUANTIZATION", quantization):
+            results = org.similarity_search(search_embedding, k=2)
+
+        # re-ranked with the full vectors
+        assert results[0] == (chunks[2], pytest.approx(1.0))
+        assert len(results) == 2
+
+    def test_similarity_search_projected(self):
+        org = OrgFactory.create(name='test company')
+        embedding = [0] * DEFAULT_EMBEDDING_DIM
+        embedding[0] = 100
+        node_content = '{"id_": "node", "text": "Chunk text", "relationships": {}}'
+        chunk = ChunkFactory.create(org=org, data={"_node_content": node_content, "URL": "https://example.com"},
+                                    embedding=embedding)
+
+        results = org.similarity_search(embedding, projected=True)
+
+        assert results == [(ChunkText(id=chunk.id, text="Chunk text", url="https://example.com"), 1.0)]
+
+    def test_hybrid_search_exact_term_first(self):
+        org = OrgFactory.create(name='test company')
+        chunks = []
+        for i in range(5):
+            embedding = [0] * DEFAULT_EMBEDDING_DIM
+            embedding[i] = 100
+            chunks.append(ChunkFactory.create(org=org, data={"text": f"Printer manual part {i}"}, embedding=embedding))
+        error_chunk = ChunkFactory.create(org=org, data={"text": "Error E-4021 means the paper tray is jammed"},
+                                          embedding=[0] * (DEFAULT_EMBEDDING_DIM - 1) + [100])
+        search_embedding = [0] * DEFAULT_EMBEDDING_DIM
+        search_embedding[0] = 100
+
+        vector_only = org.similarity_search(search_embedding, k=3)
+        hybrid = org.hybrid_search(search_embedding, "what is E-4021?", k=3)
+
+        assert vector_only[0][0] == chunks[0]
+        # found by both searches
+        assert [chunk for chunk, _ in hybrid][:2] == [error_chunk, chunks[0]]
+
+    def test_hybrid_search_other_org(self):
+        org = OrgFactory.create(name='test company')
+        other_org = OrgFactory.create(name='other company')
+        embedding = [0] * DEFAULT_EMBEDDING_DIM
+        embedding[0] = 100
+        ChunkFactory.create(org=other_org, data={"text": "Error E-4021"}, embedding=embedding)
+
+        assert org.hybrid_search(embedding, "E-4021") == []
+
 
 class TestChunk:
     def test_create_chunk_instance_with_valid_values(self):
@@ -89,6 +166,24 @@ class TestChunk:
         assert len(rows) == 2
         assert rows[0].Chunk.org_id != rows[1].Chunk.org_id
 
+    @pytest.mark.parametrize("quantization, chunk_index, expression", [
+        (None, "chunk_embedding_256_hnsw_idx", "CAST(embedding AS VECTOR(256)) vector_cosine_ops"),
+        ("halfvec", "chunk_embedding_256_halfvec_hnsw_idx", "CAST(embedding AS HALFVEC(256)) halfvec_cosine_ops"),
+        ("binary", "chunk_embedding_256_bit_hnsw_idx", "CAST(binary_quantize(embedding) AS BIT(256)) bit_hamming_ops"),
+    ])
+    def test_embedding_indexes(self, quantization, chunk_index, expression):
+        # copies of the tables, the indexes of the models stay the ones of the settings
+        metadata = MetaData()
+        tables = Chunk.__table__.to_metadata(metadata), CachedAnswer.__table__.to_metadata(metadata)
+
+        indexes = embedding_indexes(256, quantization, *tables)
+
+        # the quantized index replaces the full-precision one
+        assert [index.name for index in indexes] == [chunk_index, "cached_answer_embedding_256_hnsw_idx"]
+        ddl = str(CreateIndex(indexes[0]).compile(dialect=postgresql.dialect()))
+        assert f"USING hnsw ({expression})" in ddl
+        assert ddl.endswith("WHERE vector_dims(embedding) = 256")
+
 
 class TestGeneric:
     def test_all_models_together(self):
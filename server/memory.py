@@ -1,10 +1,11 @@
 import copy
-from typing import Any
+from typing import Any, Sequence
 
 from langchain.memory import ConversationBufferWindowMemory
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import messages_to_dict, BaseMessage, messages_from_dict
-from sqlalchemy import select, desc
+from sqlalchemy import Select, select, desc
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from db import db
 from db.models import Message
@@ -36,9 +37,23 @@ def _deserialize_messages(messages: list[Message]) -> list[BaseMessage]:
 
 def load(chat_id: str, k: int = app_settings.DEFAULT_CHAT_MEMORY_SIZE) -> ConversationBufferWindowMemory:
     """Deserialize messages from the Database and return memory object in LangChain format"""
-    stmt = select(Message).where(Message.chat_id == chat_id).order_by(desc(Message.created_at)).limit(k)
-    messages = db.session.execute(stmt).scalars().all()
-    messages.reverse()  # reverse to get the oldest messages first, to look like normal chat history
+    messages = db.session.execute(_select_messages(chat_id, k)).scalars().all()
+    return _to_memory(messages)
+
+
+async def aload(session: AsyncSession, chat_id: str,
+                k: int = app_settings.DEFAULT_CHAT_MEMORY_SIZE) -> ConversationBufferWindowMemory:
+    """Async version of `load`, for the ASGI serving mode"""
+    messages = (await session.execute(_select_messages(chat_id, k))).scalars().all()
+    return _to_memory(messages)
+
+
+def _select_messages(chat_id: str, k: int) -> Select:
+    return select(Message).where(Message.chat_id == chat_id).order_by(desc(Message.created_at)).limit(k)
+
+
+def _to_memory(messages: Sequence[Message]) -> ConversationBufferWindowMemory:
+    messages = list(reversed(messages))  # reverse to get the oldest messages first, to look like normal chat history
 
     retrieved_messages = _deserialize_messages(messages)
     retrieved_chat_history = ChatMessageHistory(messages=retrieved_messages)
@@ -52,3 +67,9 @@ def load(chat_id: str, k: int = app_settings.DEFAULT_CHAT_MEMORY_SIZE) -> Conver
 def save(chat_id: str, user_message: str, team_response: str):
     msg = Message(user_message=user_message, ai_message=team_response, chat_id=chat_id)
     msg.save()
+
+
+async def asave(session: AsyncSession, chat_id: str, user_message: str, team_response: str):
+    """Async version of `save`, for the ASGI serving mode"""
+    session.add(Message(user_message=user_message, ai_message=team_response, chat_id=chat_id))
+    await session.commit()
@@ -3,9 +3,12 @@ from typing import List
 from uuid import UUID
 
 from logger import get_logger
-from models.settings import get_documents_vector_store, get_embeddings, get_supabase_db
+from models.settings import get_documents_vector_store, get_supabase_db
 from pydantic import BaseModel
 
+from settings import app_settings
+from vdb.embeddings import get_embedding_client
+
 logger = get_logger(__name__)
 
 
@@ -25,8 +28,7 @@ class Neurons(BaseModel):
             logger.error(f"Error creating vector for document {e}")
 
     def create_embedding(self, content):
-        embeddings = get_embeddings()
-        return embeddings.embed_query(content)
+        return get_embedding_client(app_settings.EMBEDDING_MODEL, app_settings.EMBEDDING_DIM).embed([content])[0]
 
 
 def error_callback(exception):
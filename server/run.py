@@ -5,7 +5,7 @@ from pprint import pprint
 from uuid import uuid4
 
 from langchain.globals import set_verbose
-from sqlalchemy import select
+from sqlalchemy import distinct, select
 from sqlalchemy.orm import exc
 
 import memory
@@ -14,6 +14,8 @@ from bots.team import call_manager
 from db import db
 from db.models import Org, Chat, User
 from app import app
+from vdb import jobs
+from vdb.reembed import create_embedding_indexes, reembed
 from vdb.utils import archive_urls, retrieve, archive_files
 from settings import app_settings
 
@@ -30,7 +32,14 @@ def with_app_context(f):
 
 
 @with_app_context
-def main(mode: str, org: Org, query: str, store_files: str, crawl_depth: int, ignored_url: str) -> None:
+def main(mode: str, org: Org, query: str, store_files: str, crawl_depth: int, ignored_url: str,
+         background: bool) -> None:
+    if mode == "indexes":
+        # the embedding indexes of VDB_QUANTIZATION, for the dimensions of all the orgs
+        for dim in db.session.execute(select(distinct(Org.embedding_dim))).scalars():
+            create_embedding_indexes(dim)
+            print(f"Created the embedding indexes of {dim} dimensions")
+        return
     try:
         org = db.session.execute(select(Org).where(Org.name == org)).scalar_one()
     except exc.NoResultFound:
@@ -43,12 +52,23 @@ def main(mode: str, org: Org, query: str, store_files: str, crawl_depth: int, ig
             results = retrieve(query)
             pprint(results)
         elif store_files:
-            archive_files(app_settings.KNOWLEDGE_DIR)
+            if background:
+                jobs.enqueue("files", directory=app_settings.KNOWLEDGE_DIR)
+            else:
+                archive_files(app_settings.KNOWLEDGE_DIR)
             db.session.commit()
         else:
             # no query provided, let's store the documents
-            archive_urls(app_settings.KNOWLEDGE_URLS.split(','), crawl_depth, ignored_url)
+            urls = app_settings.KNOWLEDGE_URLS.split(',')
+            if background:
+                jobs.enqueue("urls", urls=urls, depth=crawl_depth, ignored_url=ignored_url)
+            else:
+                archive_urls(urls, crawl_depth, ignored_url)
             db.session.commit()
+    elif mode == "reembed":
+        # to the embedding model of the settings
+        count = reembed()
+        print(f"{count} chunks re-embedded with {app_settings.EMBEDDING_MODEL} ({app_settings.EMBEDDING_DIM})")
     elif mode == "librarian":
         while True:
             user_input = input('>>> ')
@@ -80,14 +100,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Call foo function with org_id')
     # Add the arguments
     parser.add_argument('mode', type=str,
-                        help='Application operation mode. One of: "vdb", "librarian", "chat"')
-    parser.add_argument('org', type=str, help='The Organization name')
+                        help='Application operation mode. One of: "vdb", "reembed", "indexes", "librarian", "chat"')
+    parser.add_argument('org', type=str, nargs='?', help='The Organization name, not needed by "indexes"')
     parser.add_argument('--query', type=str, help='Vector Database query string', default=None)
     parser.add_argument('--store_files', action='store_true', help='Whether to upload files to the database')
     parser.add_argument('--crawl_depth', type=int,
                         help='Depth of crawl of the URLs, default is 0 - no crawling, just scrape the given URLs',
                         default=0)
     parser.add_argument('--ignored_url', type=str, help='URL pattern to ignore', default=None)
+    parser.add_argument('--background', action='store_true',
+                        help='Queue the storing of the documents for the workers (worker.py) instead of waiting for it')
     args = parser.parse_args()
 
-    main(args.mode, args.org, args.query, args.store_files, args.crawl_depth, args.ignored_url)
+    main(args.mode, args.org, args.query, args.store_files, args.crawl_depth, args.ignored_url, args.background)
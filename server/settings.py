@@ -3,7 +3,7 @@ from __future__ import annotations
 import os
 import secrets
 import string
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import field_validator
 from pydantic.networks import EmailStr, PostgresDsn
@@ -14,10 +14,15 @@ SRC_ROOT = os.path.dirname(os.path.abspath(__file__))
 ENV = os.getenv('ENV', 'prod')
 
 
-def read_prompts_to_dict(org_name: str) -> dict[str, str]:
+def _prompts_directory(org_name: str) -> str:
     directory = os.path.join(SRC_ROOT, "bots", "prompts", org_name)
     if not os.path.exists(directory):
         directory = os.path.join(SRC_ROOT, "bots", "prompts", "langchain")
+    return directory
+
+
+def read_prompts_to_dict(org_name: str) -> dict[str, str]:
+    directory = _prompts_directory(org_name)
 
     prompts_dict = {}
     for file in os.listdir(directory):
@@ -30,6 +35,18 @@ def read_prompts_to_dict(org_name: str) -> dict[str, str]:
     return prompts_dict
 
 
+def prompts_signature(org_name: str) -> tuple:
+    """Cheap fingerprint of the org prompt files, changes whenever a prompt file is added, removed or edited"""
+    directory = _prompts_directory(org_name)
+    signature = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return directory, tuple(sorted(signature))
+
+
 class AppSettings(BaseSettings):
     """
     Deal with global app settings.
@@ -52,7 +69,10 @@ class AppSettings(BaseSettings):
     # OAUTH settings
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     JWT_ALGORITHM: str = "HS256"
-    JWT_SECRET_KEY: str
+    JWT_SECRET_KEY: str  # the JWT secret of the Supabase project, access tokens are verified locally with it
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL: float = 300.0  # seconds, capped by the token expiry
+    AUTH_REMOTE_FALLBACK: bool = False  # ask Supabase about the tokens that can't be verified locally
 
     # CORS settings
     CORS_ORIGINS: str = "*"
@@ -159,8 +179,67 @@ class AppSettings(BaseSettings):
     GPT_4: str = "gpt-4o"
 
     # LlamaIndex
+    # embedding model of the new orgs, and the one `run.py reembed` moves an org to. text-embedding-3-* models can
+    # output fewer dimensions, e.g. 256 or 512
+    EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    EMBEDDING_DIM: int = 1536
+    REEMBED_BATCH_SIZE: int = 500
     CHUNK_SIZE: int = 512
     CHUNK_OVERLAP: int = 50
+    VDB_INSERT_BATCH_SIZE: int = 500
+    VDB_INDEX_CACHE_SIZE: int = 64  # orgs whose index and retrievers are kept built in memory
+
+    # Vector search, None means the pgvector default
+    HNSW_EF_SEARCH: Optional[int] = None
+    # "strict_order" keeps org filtered results complete, requires pgvector 0.8+: older versions reject the setting
+    HNSW_ITERATIVE_SCAN: Optional[str] = None
+    IVFFLAT_PROBES: Optional[int] = None
+    VDB_QUERY_MODE: str = "hybrid"  # "hybrid" fuses the vector and full-text searches, "default" is vector only
+    VDB_HYBRID_CANDIDATES: int = 40  # chunks taken from each search before the fusion
+    VDB_RRF_K: int = 60  # reciprocal rank fusion constant, the higher the flatter the ranks
+    # search the half-precision or binary quantized HNSW index, then re-rank its candidates with the full vectors.
+    # `run.py indexes` creates the index of the quantization and drops the full-precision one
+    VDB_QUANTIZATION: Optional[Literal["halfvec", "binary"]] = None
+    VDB_RERANK_CANDIDATES: int = 100
+    QUERY_EMBEDDING_CACHE_SIZE: int = 2048  # 0 disables the cache
+    QUERY_EMBEDDING_CACHE_TTL: float = 24 * 3600.0
+    QUERY_EMBEDDING_CACHE_REDIS: bool = False  # share the cache between workers through CACHE_HOST:CACHE_PORT
+
+    # Answer cache of the product knowledge assistant
+    ANSWER_CACHE_MIN_SIMILARITY: Optional[float] = 0.95  # cosine similarity of the questions, None disables the cache
+    ANSWER_CACHE_TTL: float = 24 * 3600.0
+
+    # Ingestion pipeline, see vdb/pipeline.py
+    INGESTION_PROCESSES: Optional[int] = None  # processes parsing, cleaning and splitting, None is one per CPU
+    INGESTION_TASK_SIZE: int = 16  # documents cleaned or split by a process at once
+    INGESTION_BATCH_SIZE: int = 100  # documents embedded and committed at once, see vdb.utils._create_documents
+
+    # Embedding of the ingested chunks, see vdb/embeddings.py
+    EMBEDDING_BATCH_TOKENS: int = 300_000  # tokens per request, the API limit
+    EMBEDDING_BATCH_SIZE: int = 2048  # texts per request, the API limit
+    EMBEDDING_MAX_CONCURRENCY: int = 4  # requests sent at the same time
+    EMBEDDING_TOKENS_PER_MINUTE: Optional[int] = 1_000_000  # quota of each ingesting process, None for no limit
+    EMBEDDING_MAX_RETRIES: int = 6
+    EMBEDDING_RETRY_MAX_DELAY: float = 60.0  # seconds, when the API doesn't tell how long to wait
+
+    # Ingestion jobs, see worker.py
+    JOB_WORKER_PROCESSES: int = 2
+    JOB_POLL_INTERVAL: float = 2.0  # seconds between two looks at the queue when it is empty
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_DELAY: float = 60.0  # seconds before the first retry, doubled on each attempt
+    JOB_LEASE: float = 300.0  # a running job without heartbeat for this long is taken over by another worker
+    JOB_MAX_RUNNING_PER_ORG: int = 1
+
+    # Crawler
+    CRAWLER_MAX_CONCURRENCY: int = 10
+    CRAWLER_MAX_CONNECTIONS_PER_HOST: int = 4
+    CRAWLER_MAX_PAGES: int = 2000
+    CRAWLER_TIMEOUT: float = 30.0
+    CRAWLER_CACHE_PATH: Optional[str] = None  # SQLite file relative to the SRC_ROOT, enables re-crawl revalidation
+
+    # Agents
+    AGENT_CACHE_SIZE: int = 32  # orgs whose support team is kept built in memory
+    AGENT_MAX_PARALLEL_TOOLS: int = 4  # tool calls of one agent step run at once, 1 runs them one after another
 
     # Project settings
     DEFAULT_CHAT_MEMORY_SIZE: int = 5
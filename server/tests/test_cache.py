@@ -0,0 +1,50 @@
+from unittest.mock import patch
+
+from utils.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        # Arrange
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+
+        # Act
+        cache.set("c", 3)
+
+        # Assert
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.get("c") == 3
+
+    @patch("utils.cache.time.monotonic")
+    def test_expires_entries(self, monotonic):
+        # Arrange
+        cache = LRUCache(maxsize=2, ttl=10)
+        monotonic.return_value = 100
+        cache.set("a", 1)
+
+        # Act
+        monotonic.return_value = 111
+
+        # Assert
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_get_or_set(self):
+        # Arrange
+        cache = LRUCache(maxsize=2)
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return "value"
+
+        # Act
+        values = [cache.get_or_set("a", factory), cache.get_or_set("a", factory)]
+
+        # Assert
+        assert values == ["value", "value"]
+        assert len(calls) == 1
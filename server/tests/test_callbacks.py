@@ -0,0 +1,21 @@
+import queue
+
+from langchain_core.language_models import FakeListChatModel
+
+from bots.callbacks import TokenQueueCallbackHandler
+
+
+class TestTokenQueueCallbackHandler:
+    def test_streams_tagged_model_only(self):
+        # Arrange
+        tokens = queue.Queue()
+        handler = TokenQueueCallbackHandler(tokens, "manager")
+        manager = FakeListChatModel(responses=["Hi!"], tags=["manager"])
+        assistant = FakeListChatModel(responses=["Internal"])
+
+        # Act
+        list(assistant.stream("question", config={"callbacks": [handler]}))
+        list(manager.stream("question", config={"callbacks": [handler]}))
+
+        # Assert
+        assert list(tokens.queue) == ["H", "i", "!"]
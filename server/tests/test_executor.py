@@ -0,0 +1,97 @@
+import threading
+from contextlib import contextmanager
+
+from langchain.agents.agent import RunnableMultiActionAgent
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import Tool
+
+from bots.executor import ParallelAgentExecutor
+
+TIMEOUT = 5.0
+
+
+def _plan(inputs):
+    """Ask for both tools at once, then answer with their observations"""
+    if not inputs["intermediate_steps"]:
+        return [AgentAction(tool="slow", tool_input="first", log=""),
+                AgentAction(tool="fast", tool_input="second", log="")]
+    observations = [observation for _, observation in inputs["intermediate_steps"]]
+    return AgentFinish(return_values={"output": observations}, log="")
+
+
+class _Tools:
+    """The slow tool returns only once the fast one is done when they run concurrently"""
+
+    def __init__(self, concurrent: bool):
+        self.concurrent = concurrent
+        self.running = self.max_running = 0
+        self._lock = threading.Lock()
+        self._both_started = threading.Barrier(2, timeout=TIMEOUT)
+        self._fast_done = threading.Event()
+
+    def slow(self, query):
+        with self._running():
+            if self.concurrent:
+                self._both_started.wait()
+                assert self._fast_done.wait(TIMEOUT)
+            return f"slow {query}"
+
+    def fast(self, query):
+        with self._running():
+            if self.concurrent:
+                self._both_started.wait()
+            self._fast_done.set()
+            return f"fast {query}"
+
+    @contextmanager
+    def _running(self):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class TestParallelAgentExecutor:
+    @staticmethod
+    def _executor(tools, max_parallel_tools):
+        agent = RunnableMultiActionAgent(runnable=RunnableLambda(_plan), input_keys_arg=["input"],
+                                         return_keys_arg=["output"])
+        return ParallelAgentExecutor(
+            agent=agent,
+            tools=[
+                Tool.from_function(func=tools.slow, name="slow", description="slow tool"),
+                Tool.from_function(func=tools.fast, name="fast", description="fast tool"),
+            ],
+            max_parallel_tools=max_parallel_tools,
+        )
+
+    def test_tool_calls_run_concurrently(self):
+        # Arrange
+        tools = _Tools(concurrent=True)
+        executor = self._executor(tools, max_parallel_tools=2)
+
+        # Act
+        output = executor.invoke({"input": "question"})["output"]
+
+        # Assert
+        # both tools waited for each other, the fast one completed first
+        assert tools.max_running == 2
+        # in the order of the calls, not of their completion
+        assert output == ["slow first", "fast second"]
+
+    def test_sequential(self):
+        # Arrange
+        tools = _Tools(concurrent=False)
+        executor = self._executor(tools, max_parallel_tools=1)
+
+        # Act
+        output = executor.invoke({"input": "question"})["output"]
+
+        # Assert
+        assert tools.max_running == 1
+        assert output == ["slow first", "fast second"]
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from utils import json as json_utils
+from utils.json import json_loads, register_datetime_keys
+
+
+@pytest.fixture(autouse=True)
+def datetime_keys():
+    keys = set(json_utils._datetime_keys)
+    yield
+    json_utils._datetime_keys.clear()
+    json_utils._datetime_keys.update(keys)
+
+
+class TestJsonLoads:
+    def test_plain_decoding(self):
+        # Act
+        value = json_loads('{"created_at": "2019-05-18T15:17:00+00:00", "nested": {"a": [1, 2]}}')
+
+        # Assert
+        assert value == {"created_at": "2019-05-18T15:17:00+00:00", "nested": {"a": [1, 2]}}
+
+    def test_registered_keys(self):
+        # Arrange
+        register_datetime_keys("created_at")
+
+        # Act
+        value = json_loads('{"created_at": "2019-05-18T15:17:00+00:00", "title": "2019-05-18T15:17:00+00:00", '
+                           '"nested": {"created_at": "not a date"}}')
+
+        # Assert
+        assert value == {
+            "created_at": datetime(2019, 5, 18, 15, 17, tzinfo=timezone.utc),
+            "title": "2019-05-18T15:17:00+00:00",
+            "nested": {"created_at": "not a date"},
+        }
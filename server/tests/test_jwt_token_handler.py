@@ -0,0 +1,30 @@
+from datetime import timedelta
+from uuid import uuid4
+
+from auth import create_access_token, decode_access_token
+
+
+class TestDecodeAccessToken:
+    def test_valid_token(self):
+        # Arrange
+        user_id = uuid4()
+        token = create_access_token({"sub": str(user_id), "email": "user@example.com", "aud": "authenticated"})
+
+        # Act
+        identity = decode_access_token(token)
+
+        # Assert
+        assert identity.id == user_id
+        assert identity.email == "user@example.com"
+        assert identity.expires_at is not None
+
+    def test_expired_token(self):
+        token = create_access_token({"sub": str(uuid4())}, expires_delta=timedelta(minutes=-1))
+        assert decode_access_token(token) is None
+
+    def test_token_without_user(self):
+        token = create_access_token({"email": "user@example.com"})
+        assert decode_access_token(token) is None
+
+    def test_invalid_token(self):
+        assert decode_access_token("incorrect_token") is None
@@ -0,0 +1,20 @@
+import uuid
+from unittest.mock import patch
+
+from bots.librarian import enqueue_urls
+from db.models import IngestionJob
+
+
+class TestEnqueueUrls:
+    @patch("bots.librarian.jobs.enqueue")
+    def test_enqueues_all_urls(self, enqueue):
+        # Arrange
+        job_id = uuid.uuid4()
+        enqueue.return_value = IngestionJob(id=job_id)
+
+        # Act
+        response = enqueue_urls("https://example.com/docs; https://example.com/pricing;")
+
+        # Assert
+        enqueue.assert_called_once_with("urls", urls=["https://example.com/docs", "https://example.com/pricing"])
+        assert str(job_id) in response
@@ -0,0 +1,96 @@
+import uuid
+from unittest.mock import patch
+
+from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.runnables import RunnableLambda
+
+from bots import team
+from bots.team import ISSUER_TOOL_NAME, call_manager, invalidate_team, with_answer_cache
+from db.models import Org
+from vdb import answer_cache
+
+
+class TestCallManager:
+    def setup_method(self):
+        invalidate_team()
+        Org.current.set(Org(id=uuid.uuid4(), name="langchain"))
+
+    def test_team_is_reused(self):
+        # Arrange
+        first_memory = ConversationBufferWindowMemory(memory_key="memory", return_messages=True)
+        second_memory = ConversationBufferWindowMemory(memory_key="memory", return_messages=True)
+
+        # Act
+        with patch("bots.team._build_team", wraps=team._build_team) as build_team:
+            first = call_manager(first_memory)
+            second = call_manager(second_memory)
+
+        # Assert
+        build_team.assert_called_once()
+        assert first.agent.runnable is second.agent.runnable
+        assert first.memory.chat_memory is first_memory.chat_memory
+        assert second.memory.chat_memory is second_memory.chat_memory
+
+    def test_issuer_memory_is_per_call(self):
+        # Act
+        first = call_manager(ConversationBufferWindowMemory(memory_key="memory", return_messages=True))
+        second = call_manager(ConversationBufferWindowMemory(memory_key="memory", return_messages=True))
+
+        # Assert
+        first_issuer = next(tool for tool in first.tools if tool.name == ISSUER_TOOL_NAME)
+        second_issuer = next(tool for tool in second.tools if tool.name == ISSUER_TOOL_NAME)
+        assert first_issuer.func.__self__.memory.chat_memory is not second_issuer.func.__self__.memory.chat_memory
+        cached_tools = team._teams.get(Org.current.get().id).tools
+        assert [tool.name for tool in first.tools] == [tool.name for tool in cached_tools]
+
+    def test_team_is_rebuilt_when_prompts_change(self):
+        # Arrange
+        memory = ConversationBufferWindowMemory(memory_key="memory", return_messages=True)
+        first = call_manager(memory)
+
+        # Act
+        with patch("bots.team.prompts_signature", return_value=("edited",)):
+            second = call_manager(memory)
+
+        # Assert
+        assert first.agent.runnable is not second.agent.runnable
+
+    def test_invalidate_team(self):
+        # Arrange
+        memory = ConversationBufferWindowMemory(memory_key="memory", return_messages=True)
+        first = call_manager(memory)
+
+        # Act
+        invalidate_team(Org.current.get().id)
+        second = call_manager(memory)
+
+        # Assert
+        assert first.agent.runnable is not second.agent.runnable
+
+
+class TestWithAnswerCache:
+    @patch("bots.team.answer_cache.store")
+    @patch("bots.team.answer_cache.lookup", return_value="cached answer")
+    def test_hit(self, lookup, store):
+        # Arrange
+        chain = RunnableLambda(lambda inputs: "fresh answer")
+
+        # Act
+        answer = with_answer_cache(chain, "prompt").invoke({"user_question": "How to log in?", "query": "log in"})
+
+        # Assert
+        assert answer == "cached answer"
+        store.assert_not_called()
+
+    @patch("bots.team.answer_cache.store")
+    @patch("bots.team.answer_cache.lookup", return_value=None)
+    def test_miss(self, lookup, store):
+        # Arrange
+        chain = RunnableLambda(lambda inputs: "fresh answer")
+
+        # Act
+        answer = with_answer_cache(chain, "prompt").invoke({"user_question": "How to log in?", "query": "log in"})
+
+        # Assert
+        assert answer == "fresh answer"
+        store.assert_called_once_with("How to log in?", answer_cache.prompt_hash("prompt"), "fresh answer")
@@ -1,4 +1,7 @@
-from vdb.utils import _clean
+from llama_index.core.schema import Document
+
+from vdb.pipeline import clean_text as _clean
+from vdb.utils import _source_batches
 
 
 def test_clean():
@@ -11,3 +14,15 @@ def test_clean():
     assert _clean("Hello, \nWorld!") == "Hello, World!"
     assert _clean("Hello, ЯЯЯ“World!”") == 'Hello, World!'
     assert _clean("") == ""  # Test case for empty string
+
+
+def test_source_batches():
+    documents = [Document(text=f"Page {i}", extra_info={"URL": f"https://example.com/{i}"}) for i in range(5)]
+    # the pages of a file, then documents without source
+    documents[2:2] = [Document(text=f"Page {i}", extra_info={"file_path": "manual.pdf"}) for i in range(3)]
+    documents += [Document(text="Text"), Document(text="Text")]
+
+    batches = list(_source_batches(iter(documents), 2))
+
+    assert [len(batch) for batch in batches] == [2, 3, 2, 2, 1]
+    assert [document for batch in batches for document in batch] == documents
@@ -60,12 +60,17 @@ We have named the `object_hook` function :func:`from_serializable`. Reason for n
 decoding functions differently then `default` and `object_hook` is that they are also used outside of the context of
 :func:`json.dumps` and :func:`json.loads`.
 
+.. note:: :func:`json_loads`, the deserializer of the database engine, doesn't use :func:`from_serializable`: running
+   a Python hook for every `dict` of every JSON value is most of the cost of loading large values such as the chunks.
+   Only the values of the keys registered with :func:`register_datetime_keys` are decoded into :obj:`datetime`
+   objects, everything else is decoded by rapidjson alone. See `benchmarks/json_deserializer.py`.
+
 """
 
 from contextlib import suppress
 from dataclasses import asdict, is_dataclass
 from datetime import datetime
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Set, Tuple, Union
 from uuid import UUID
 
 import rapidjson as json
@@ -79,8 +84,19 @@ PY_JSON_TYPES = Union[Dict[str, Any], List, str, int, float, bool, None, object]
 logger = structlog.get_logger(__name__)
 
 
+# keys whose values `json_loads` decodes into datetimes
+_datetime_keys: Set[str] = set()
+
+
+def register_datetime_keys(*keys: str) -> None:
+    """Decode the ISO formatted values of these keys into datetimes in :func:`json_loads`, wherever the keys are"""
+    _datetime_keys.update(keys)
+
+
 def json_loads(s: Union[str, bytes, bytearray]) -> PY_JSON_TYPES:
-    return json.loads(s, object_hook=from_serializable)
+    if not _datetime_keys:
+        return json.loads(s)
+    return json.loads(s, object_hook=_datetimes_from_serializable)
 
 
 def json_dumps(obj: PY_JSON_TYPES) -> str:
@@ -140,6 +156,16 @@ def from_serializable(dct: Dict[str, Any]) -> Dict[str, Any]:
     return dct
 
 
+def _datetimes_from_serializable(dct: Dict[str, Any]) -> Dict[str, Any]:
+    # a set intersection is all it costs for the dicts without registered keys
+    for k in _datetime_keys.intersection(dct):
+        v = dct[k]
+        if isinstance(v, str):
+            with suppress(ValueError):
+                dct[k] = datetime.fromisoformat(v)
+    return dct
+
+
 def non_none_dict(dikt: List[Tuple[str, Any]]) -> Dict[Any, Any]:
     """
     Return no `None` values in a Dict.
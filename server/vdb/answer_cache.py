@@ -0,0 +1,111 @@
+"""
+Semantic cache of the answers of the product knowledge assistant.
+
+A question gets the cached answer of a previous question of the org when their embeddings are close enough. The
+org's cached answers are dropped whenever its chunks change, see `ChunkVectorStore`.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from hashlib import sha256
+from typing import Optional
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from db import db
+from db.models import CachedAnswer, Org, dimension_filter, set_vector_search_params
+from settings import app_settings
+from vdb.query_cache import get_query_embedding
+from vdb.service_context import get_embed_model
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCacheStats:
+    """Hit and miss counters of the worker"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+stats = AnswerCacheStats()
+
+
+def is_enabled() -> bool:
+    return app_settings.ANSWER_CACHE_MIN_SIMILARITY is not None
+
+
+def prompt_hash(prompt: str) -> str:
+    """Answers are only reused for the same prompt"""
+    return sha256(prompt.encode()).hexdigest()
+
+
+def lookup(question: str, prompt_hash_value: str) -> Optional[str]:
+    """The cached answer of the closest question of the current org, None when no question is close enough"""
+    org = Org.current.get()
+    embedding = get_query_embedding(question, get_embed_model())
+    # the expression of the index of the dimension, see `embedding_indexes`
+    distance = CachedAnswer.embedding.cast(Vector(len(embedding))).cosine_distance(embedding)
+    query = (
+        select(CachedAnswer.answer, 1 - distance)
+        .where(CachedAnswer.org_id == org.id,
+               CachedAnswer.prompt_hash == prompt_hash_value,
+               CachedAnswer.created_at >= _oldest_valid(),
+               dimension_filter(CachedAnswer.embedding, len(embedding)))
+        .order_by(distance)
+        .limit(1)
+    )
+    # own short session, so that no connection is held while the LLM answers on a miss
+    with Session(db.engine) as session:
+        set_vector_search_params({"hnsw.iterative_scan": app_settings.HNSW_ITERATIVE_SCAN}, session)
+        row = session.execute(query).first()
+
+    hit = row is not None and row[1] >= app_settings.ANSWER_CACHE_MIN_SIMILARITY
+    stats.record(hit)
+    if hit:
+        logger.info(f"Answer cache hit, similarity {row[1]:.3f}: {question}")
+        return row[0]
+    return None
+
+
+def store(question: str, prompt_hash_value: str, answer: str) -> None:
+    """Cache the answer and drop the expired answers of the current org"""
+    org = Org.current.get()
+    embedding = get_query_embedding(question, get_embed_model())
+    # committed on its own, the answer is valid whatever happens to the request
+    with Session(db.engine) as session, session.begin():
+        session.execute(
+            delete(CachedAnswer).where(CachedAnswer.org_id == org.id, CachedAnswer.created_at < _oldest_valid())
+        )
+        session.add(CachedAnswer(org_id=org.id, prompt_hash=prompt_hash_value, question=question, answer=answer,
+                                 embedding=embedding))
+
+
+def invalidate(org_id) -> None:
+    """Drop the cached answers of the org, in the transaction of the session that changes its chunks"""
+    db.session.execute(delete(CachedAnswer).where(CachedAnswer.org_id == org_id))
+
+
+def _oldest_valid() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=app_settings.ANSWER_CACHE_TTL)
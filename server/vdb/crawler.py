@@ -1,16 +1,25 @@
-"""Web crawler with depth control."""
+"""Concurrent web crawler with depth control."""
 
+import asyncio
 import logging
-from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
 from urllib.parse import urljoin
 from urllib.parse import urlparse
 
+import httpx
 import requests
 from bs4 import BeautifulSoup
 from llama_index.core.readers.base import BaseReader
 from llama_index.core.schema import Document
 from usp.tree import sitemap_tree_for_homepage
 
+from vdb.http_cache import HttpCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -134,11 +143,28 @@ DEFAULT_WEBSITE_EXTRACTOR: Dict[
 }
 
 
+# extensions that are served as web pages, the rest may point to files and are probed with HEAD first
+PAGE_EXTENSIONS = {"", ".html", ".htm", ".xhtml", ".php", ".asp", ".aspx", ".jsp"}
+
+
 def is_downloadable(url):
-    response = requests.get(url, stream=True)
+    with requests.head(url, allow_redirects=True) as response:
+        return _is_downloadable_response(url, response.headers)
+
 
-    headers = response.headers
+class _Page(NamedTuple):
+    content: bytes
+    modified: bool  # False if the page didn't change since it was cached
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
 
+
+def _url_extension(url: str) -> str:
+    return os.path.splitext(urlparse(url).path)[1].lower()
+
+
+def _is_downloadable_response(url: str, headers: Mapping[str, str]) -> bool:
+    """Tell by the response headers if the URL points to a file rather than to a web page"""
     content_type = headers.get('Content-Type', '')
     content_disposition = headers.get('Content-Disposition', '')
 
@@ -152,29 +178,97 @@ def is_downloadable(url):
         return False
 
 
+def _process_page(url, hostname, page, include_url_in_text, follow_links, website_extractor, ignored_url):
+    """Parse the page into its document and links, run by the executor of the crawler"""
+    soup = BeautifulSoup(page, "html.parser")
+    links = _extract_links(url, hostname, soup, ignored_url) if follow_links else []
+    return _parse_document(url, hostname, include_url_in_text, soup, website_extractor), links
+
+
+def _page_links(url, hostname, page, ignored_url):
+    return _extract_links(url, hostname, BeautifulSoup(page, "html.parser"), ignored_url)
+
+
+def _extract_links(url, hostname, soup, ignored_url):
+    links = []
+    for link in soup.find_all("a", href=True):
+        sub_url = urljoin(url, urlparse(link['href']).path)
+        # only crawl if we are on the same domain
+        if hostname != urlparse(sub_url).hostname:
+            continue
+        if ignored_url and ignored_url in sub_url:
+            continue
+        links.append(sub_url)
+    return links
+
+
+def _parse_document(url, hostname, include_url_in_text, soup, website_extractor):
+    extra_info = {"URL": url}
+    if hostname in website_extractor:
+        data, metadata = website_extractor[hostname](
+            soup=soup, url=url, include_url_in_text=include_url_in_text
+        )
+        extra_info.update(metadata)
+
+    else:
+        data = soup.getText()
+
+    return Document(text=data, extra_info=extra_info)
+
+
 class WebCrawler(BaseReader):
     """BeautifulSoup web page crawler.
 
-    Reads pages from the web.
-    Requires the `bs4` and `urllib` packages.
+    Reads pages from the web concurrently: a pool of workers takes URLs from a frontier queue and fetches them
+    through a shared keep-alive HTTP client.
+    Requires the `bs4`, `httpx` and `urllib` packages.
 
     Args:
         website_extractor (Optional[Dict[str, Callable]]): A mapping of website
             hostname (e.g. google.com) to a function that specifies how to
             extract text from the BeautifulSoup obj. See DEFAULT_WEBSITE_EXTRACTOR.
         depth (int): Depth of the crawler. If 0, no crawling is performed.
+        max_concurrency (int): Number of pages fetched at the same time.
+        max_connections_per_host (int): Number of pages fetched at the same time from a single host.
+        max_pages (int): Maximum number of pages to fetch during the crawl.
+        timeout (float): Timeout of a single request, in seconds.
+        cache (Optional[HttpCache]): Cache of the previous crawls. Cached pages are revalidated with conditional
+            requests, and the ones that didn't change are only followed for links, no document is produced.
+            The fetched pages are put in the cache at the end of `load_data`, or by `cache_pages` once their
+            documents are stored when they are streamed by `lazy_load_data`.
+        executor (Optional[Executor]): Executor parsing the pages, e.g. the process pool of vdb.pipeline, so that
+            parsing uses several cores. The website extractors must then be picklable. Threads by default.
     """
 
     def __init__(
             self,
             website_extractor: Optional[Dict[str, Callable]] = None,
             depth: int = 0,
+            max_concurrency: int = 10,
+            max_connections_per_host: int = 4,
+            max_pages: int = 2000,
+            timeout: float = 30.0,
+            cache: Optional[HttpCache] = None,
+            executor: Optional[Executor] = None,
     ) -> None:
         """Initialize with parameters."""
         self.website_extractor = website_extractor or DEFAULT_WEBSITE_EXTRACTOR
         self.depth = depth
+        self.max_concurrency = max_concurrency
+        self.max_connections_per_host = max_connections_per_host
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.cache = cache
+        self.executor = executor
         self.scanned_urls = set()
         self.ignored_url = None
+        # content type probe results for the crawl session: is the URL (or any URL with the extension) a file,
+        # page extensions are not cached since any of them may be an attachment or an API endpoint
+        self.probed_urls: Dict[str, bool] = {}
+        self.probed_extensions: Dict[str, bool] = {}
+        # fetched pages with validators, not in the cache yet
+        self.uncached_pages: Dict[str, _Page] = {}
+        self._stopped = threading.Event()
 
     def load_data(
             self,
@@ -195,69 +289,213 @@ class WebCrawler(BaseReader):
         Returns:
             List[Document]: List of documents.
         """
-        if ignored_url:
-            self.ignored_url = ignored_url
+        crawl = self.aload_data(urls, custom_hostname, ignored_url, include_url_in_text)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(crawl)
+        # called from an event loop, e.g. by an async agent tool: the crawl runs in a loop of its own
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="crawler") as thread:
+            return thread.submit(asyncio.run, crawl).result()
+
+    async def aload_data(
+            self,
+            urls: List[str],
+            custom_hostname: Optional[str] = None,
+            ignored_url: Optional[str] = None,
+            include_url_in_text: Optional[bool] = True,
+    ) -> List[Document]:
+        """Load data from the urls asynchronously, see `load_data`."""
         documents = []
-        extended_urls = self._add_sitemaps(urls)
-        for url in extended_urls:
-            url_documents = self._crawl_url(url, custom_hostname, include_url_in_text)
-            documents.extend(url_documents)
 
+        async def on_document(document: Document) -> None:
+            documents.append(document)
+
+        self._stopped.clear()
+        await self._crawl(urls, custom_hostname, ignored_url, include_url_in_text, on_document)
+        self.cache_pages(list(self.uncached_pages))
         return documents
 
-    def _crawl_url(self, url, custom_hostname, include_url_in_text, cur_depth=0):
-        if cur_depth > self.depth or is_downloadable(url):
-            # stop condition
-            return []
+    def lazy_load_data(
+            self,
+            urls: List[str],
+            custom_hostname: Optional[str] = None,
+            ignored_url: Optional[str] = None,
+            include_url_in_text: Optional[bool] = True,
+    ) -> Iterator[Document]:
+        """Yield the documents of the urls as they are crawled, see `load_data`.
 
-        # setup
-        try:
-            page = requests.get(url)
-            self.scanned_urls.add(url)
-            logger.info(f"Processing '{url}' URL.")
-        except Exception as e:
-            # soft fail, log and continue with other URLs
-            logger.warning(f"{str(e)} error occurred while processing '{url}' URL.")
-            return []
-
-        hostname = custom_hostname or urlparse(url).hostname
-        soup = BeautifulSoup(page.content, "html.parser")
-
-        # recursive link construction (crawling)
-        documents = []
-        links = soup.find_all("a", href=True)
-        for link in links:
-            sub_url = urljoin(url, urlparse(link['href']).path)
-            if hostname == urlparse(sub_url).hostname and sub_url not in self.scanned_urls:
-                if self.ignored_url and self.ignored_url in sub_url:
+        The crawl runs in a thread and waits for the consumer when `max_concurrency` documents are not consumed
+        yet, so that the memory use doesn't grow with the size of the site. Closing the iterator stops the crawl.
+        Call `cache_pages` once the documents are stored.
+        """
+        buffer: queue.Queue = queue.Queue(maxsize=self.max_concurrency)
+        end = object()
+
+        def put(item: Any) -> None:
+            # gives up when the consumer is gone
+            while not self._stopped.is_set():
+                try:
+                    buffer.put(item, timeout=1.0)
+                    return
+                except queue.Full:
                     continue
-                # only crawl if we are on the same domain
-                sub_documents = self._crawl_url(
-                    sub_url,
-                    custom_hostname,
-                    include_url_in_text,
-                    cur_depth + 1
-                )
-                documents.extend(sub_documents)
 
-        # current page parsing
-        document = self._parse_document(url, hostname, include_url_in_text, soup)
-        documents.append(document)
+        async def on_document(document: Document) -> None:
+            await asyncio.to_thread(put, document)
 
-        return documents
+        def crawl() -> None:
+            try:
+                asyncio.run(self._crawl(urls, custom_hostname, ignored_url, include_url_in_text, on_document))
+            except Exception as e:
+                put(e)
+            else:
+                put(end)
 
-    def _parse_document(self, url, hostname, include_url_in_text, soup):
-        extra_info = {"URL": url}
-        if hostname in self.website_extractor:
-            data, metadata = self.website_extractor[hostname](
-                soup=soup, url=url, include_url_in_text=include_url_in_text
-            )
-            extra_info.update(metadata)
+        self._stopped.clear()
+        thread = threading.Thread(target=crawl, name="crawler", daemon=True)
+        thread.start()
+        try:
+            while (item := buffer.get()) is not end:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self._stopped.set()
+            thread.join()
+
+    def cache_pages(self, urls: Iterable[str]) -> None:
+        """Put the fetched pages of the urls in the cache, to be committed by the caller"""
+        for url in urls:
+            page = self.uncached_pages.pop(url, None)
+            if page is not None and self.cache:
+                self.cache.put(url, page.etag, page.last_modified, page.content)
+
+    async def _crawl(
+            self,
+            urls: List[str],
+            custom_hostname: Optional[str],
+            ignored_url: Optional[str],
+            include_url_in_text: Optional[bool],
+            on_document: Callable[[Document], Awaitable[None]],
+    ) -> None:
+        if ignored_url:
+            self.ignored_url = ignored_url
+        extended_urls = await asyncio.to_thread(self._add_sitemaps, urls)
 
-        else:
-            data = soup.getText()
+        frontier: asyncio.Queue[Tuple[str, int]] = asyncio.Queue()
+        for url in extended_urls:
+            self._enqueue(frontier, url, 0)
+
+        host_limits = defaultdict(lambda: asyncio.Semaphore(self.max_connections_per_host))
+        async with self._client() as client:
+            workers = [
+                asyncio.create_task(
+                    self._worker(client, frontier, host_limits, on_document, custom_hostname, include_url_in_text)
+                )
+                for _ in range(self.max_concurrency)
+            ]
+            await frontier.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def _client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout, follow_redirects=True)
+
+    def _enqueue(self, frontier: asyncio.Queue, url: str, cur_depth: int) -> None:
+        if cur_depth > self.depth or url in self.scanned_urls or self._stopped.is_set():
+            return
+        if len(self.scanned_urls) >= self.max_pages:
+            logger.warning(f"Page budget of {self.max_pages} is exhausted, skipping '{url}' URL.")
+            return
+        self.scanned_urls.add(url)
+        frontier.put_nowait((url, cur_depth))
+
+    async def _worker(self, client, frontier, host_limits, on_document, custom_hostname, include_url_in_text):
+        while True:
+            url, cur_depth = await frontier.get()
+            try:
+                if self._stopped.is_set():
+                    # the consumer is gone, the frontier is drained without fetching
+                    continue
+                async with host_limits[urlparse(url).hostname]:
+                    page = await self._fetch(client, url)
+                if page is None:
+                    continue
+                hostname = custom_hostname or urlparse(url).hostname
+                follow_links = cur_depth < self.depth
+                # parsing is CPU bound and the site extractors do blocking requests, keep the loop free
+                loop = asyncio.get_running_loop()
+                if page.modified:
+                    logger.info(f"Processing '{url}' URL.")
+                    document, links = await loop.run_in_executor(
+                        self.executor, _process_page, url, hostname, page.content, include_url_in_text, follow_links,
+                        self.website_extractor, self.ignored_url
+                    )
+                    if self.cache and (page.etag or page.last_modified):
+                        self.uncached_pages[url] = page
+                    await on_document(document)
+                else:
+                    logger.info(f"'{url}' URL didn't change since the last crawl.")
+                    links = []
+                    if follow_links:
+                        links = await loop.run_in_executor(
+                            self.executor, _page_links, url, hostname, page.content, self.ignored_url
+                        )
+                for sub_url in links:
+                    self._enqueue(frontier, sub_url, cur_depth + 1)
+            except Exception as e:
+                # soft fail, log and continue with other URLs
+                logger.warning(f"{str(e)} error occurred while processing '{url}' URL.")
+            finally:
+                frontier.task_done()
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str) -> Optional[_Page]:
+        """Fetch the page, the body is not downloaded if the URL points to a file
+
+        The GET request doubles as the content type probe. A HEAD request is only sent first for URLs whose
+        extension may point to a file and wasn't probed yet.
+        """
+        extension = _url_extension(url)
+        if self.probed_urls.get(url) or (extension not in PAGE_EXTENSIONS and self.probed_extensions.get(extension)):
+            logger.info(f"The URL points to a downloadable file: {url}")
+            return None
+
+        if extension not in PAGE_EXTENSIONS and extension not in self.probed_extensions:
+            response = await client.head(url)
+            # some servers don't support HEAD, the GET below will tell then
+            if response.is_success and self._probe(url, response.headers):
+                return None
+
+        # SQLite lookup, off the event loop of the other fetches
+        cached = await asyncio.to_thread(self.cache.get, url) if self.cache else None
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if cached and response.status_code == httpx.codes.NOT_MODIFIED:
+                return _Page(cached.content, modified=False)
+            if self._probe(url, response.headers):
+                return None
+            return _Page(
+                await response.aread(),
+                modified=True,
+                etag=response.headers.get("ETag") if response.is_success else None,
+                last_modified=response.headers.get("Last-Modified") if response.is_success else None,
+            )
 
-        return Document(text=data, extra_info=extra_info)
+    def _probe(self, url: str, headers: Mapping[str, str]) -> bool:
+        downloadable = _is_downloadable_response(url, headers)
+        self.probed_urls[url] = downloadable
+        extension = _url_extension(url)
+        if extension not in PAGE_EXTENSIONS:
+            self.probed_extensions[extension] = downloadable
+        return downloadable
 
     def _add_sitemaps(self, urls):
         new_urls = set()
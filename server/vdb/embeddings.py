@@ -0,0 +1,176 @@
+"""
+Embedding of the ingested texts through the OpenAI API, as fast as the quota of the API key allows.
+
+The texts are packed into requests of up to EMBEDDING_BATCH_TOKENS tokens and EMBEDDING_BATCH_SIZE inputs, sent
+EMBEDDING_MAX_CONCURRENCY at a time. A token bucket holds the requests back to EMBEDDING_TOKENS_PER_MINUTE, the
+quota of the process: split the quota of the key between the processes that ingest at the same time. A rate limited
+request empties the bucket, so that the other requests wait too, and is retried after the delay the API asks for,
+other transient errors are retried with an exponential backoff.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import openai
+from llama_index.core.base.embeddings.base import Embedding
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+from db.models import Org
+from settings import app_settings
+from vdb.service_context import embedding_dimensions
+
+logger = logging.getLogger(__name__)
+
+_RETRIED_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                   openai.InternalServerError)
+
+
+class TokenBucket:
+    """Rate limiter of the tokens sent to the API, shared by the threads of the process
+
+    :param tokens_per_minute: refill rate and capacity of the bucket
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Wait until the tokens can be sent"""
+        # a request bigger than the budget of a minute waits for a full bucket
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) * 60 / self.capacity
+            time.sleep(wait)
+
+    def empty(self) -> None:
+        """Hold all the requests back, the API rate limited one"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+
+class EmbeddingClient:
+    """Batched, concurrent and rate limited embeddings of a model
+
+    :param client: OpenAI client, without retries of its own
+    :param bucket: rate limiter, None for no limit
+    """
+
+    def __init__(self, model_name: str, dim: int, client: Optional[openai.OpenAI] = None,
+                 bucket: Optional[TokenBucket] = None):
+        self.model_name = model_name
+        self.dimensions = embedding_dimensions(model_name, dim)
+        self.client = client or openai.OpenAI(api_key=app_settings.OPENAI_API_KEY, max_retries=0)
+        self.bucket = bucket
+        # the tokenizer of the chunk sizes, the one of the OpenAI embedding models
+        self.tokenizer = get_tokenizer()
+
+    def embed(self, texts: Sequence[str]) -> List[Embedding]:
+        """Embeddings of the texts, in the order of the texts"""
+        if not texts:
+            return []
+        # as the LlamaIndex OpenAI embedding does, so that the chunks are embedded like the queries
+        texts = [text.replace("\n", " ") for text in texts]
+        batches = list(self._batches(texts))
+        if len(batches) > 1:
+            logger.info(f"Embedding {len(texts)} texts in {len(batches)} requests")
+        with ThreadPoolExecutor(max_workers=app_settings.EMBEDDING_MAX_CONCURRENCY) as executor:
+            results = executor.map(lambda batch: self._embed_batch(*batch), batches)
+            return [embedding for embeddings in results for embedding in embeddings]
+
+    def _batches(self, texts: Sequence[str]) -> Iterator[Tuple[List[str], int]]:
+        """The texts packed into requests, with their number of tokens"""
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = len(self.tokenizer(text))
+            if batch and (batch_tokens + tokens > app_settings.EMBEDDING_BATCH_TOKENS
+                          or len(batch) >= app_settings.EMBEDDING_BATCH_SIZE):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def _embed_batch(self, texts: List[str], tokens: int) -> List[Embedding]:
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.bucket.acquire(tokens)
+            try:
+                return self._request(texts)
+            except _RETRIED_ERRORS as e:
+                attempt += 1
+                if attempt > app_settings.EMBEDDING_MAX_RETRIES:
+                    raise
+                delay = _retry_delay(e, attempt)
+                if isinstance(e, openai.RateLimitError) and self.bucket is not None:
+                    self.bucket.empty()
+                logger.warning(f"Embedding request of {len(texts)} texts failed ({e!r}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _request(self, texts: List[str]) -> List[Embedding]:
+        kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+        response = self.client.embeddings.create(input=texts, model=self.model_name, **kwargs)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def get_embedding_client(model_name: Optional[str] = None, dim: Optional[int] = None) -> EmbeddingClient:
+    """The client of the embedding model, the one of the current org by default"""
+    if model_name is None:
+        org = Org.current.get()
+        model_name = org.embedding_model or app_settings.EMBEDDING_MODEL
+        dim = org.embedding_dim or app_settings.EMBEDDING_DIM
+    return _get_embedding_client(model_name, dim)
+
+
+@cache
+def _get_embedding_client(model_name: str, dim: int) -> EmbeddingClient:
+    return EmbeddingClient(model_name, dim, bucket=_get_bucket(model_name))
+
+
+@cache
+def _get_bucket(model_name: str) -> Optional[TokenBucket]:
+    # the quota of the API is per model, whatever the dimensions
+    if not app_settings.EMBEDDING_TOKENS_PER_MINUTE:
+        return None
+    return TokenBucket(app_settings.EMBEDDING_TOKENS_PER_MINUTE)
+
+
+def embed_nodes(nodes: Sequence[BaseNode], client: EmbeddingClient) -> None:
+    """Set the embeddings of the nodes, computed from their content and metadata"""
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    for node, embedding in zip(nodes, client.embed(texts)):
+        node.embedding = embedding
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # exponential backoff with jitter, so that the concurrent requests don't retry all at once
+    return min(app_settings.EMBEDDING_RETRY_MAX_DELAY, 2 ** attempt) * random.uniform(0.5, 1.0)
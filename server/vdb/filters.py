@@ -0,0 +1,77 @@
+"""
+Translation of the LlamaIndex metadata filters into SQL predicates on the chunks.
+
+The metadata of a node is stored at the top level of `Chunk.data`. Equality and containment filters are translated
+to JSONB containment, which the GIN index of the column serves, so that a restricted search costs no more than an
+unrestricted one. `source_id` is one of the sources of the chunk rather than metadata.
+"""
+from __future__ import annotations
+
+from typing import Any, Optional, Union
+
+from llama_index.core.vector_stores.types import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
+from sqlalchemy import ColumnElement, and_, not_, or_, select
+
+from db.models import Chunk, ChunkSource
+
+
+def to_sql(filters: Optional[MetadataFilters]) -> Optional[ColumnElement[bool]]:
+    """The predicate of the filters, None when there is nothing to filter"""
+    if filters is None or not filters.filters:
+        return None
+    return _filters_to_sql(filters)
+
+
+def _filters_to_sql(filters: MetadataFilters) -> ColumnElement[bool]:
+    predicates = [_filters_to_sql(f) if isinstance(f, MetadataFilters) else _filter_to_sql(f)
+                  for f in filters.filters]
+    if filters.condition == FilterCondition.OR:
+        return or_(*predicates)
+    return and_(*predicates)
+
+
+def _filter_to_sql(metadata_filter: MetadataFilter) -> ColumnElement[bool]:
+    key, value, operator = metadata_filter.key, metadata_filter.value, metadata_filter.operator
+    if key == "source_id":
+        return _source_filter_to_sql(value, operator)
+
+    data = Chunk.data
+    if operator == FilterOperator.EQ:
+        return data.contains({key: value})
+    if operator == FilterOperator.NE:
+        return not_(data.contains({key: value}))
+    if operator == FilterOperator.IN:
+        return or_(*[data.contains({key: v}) for v in _as_list(value)])
+    if operator == FilterOperator.NIN:
+        return not_(or_(*[data.contains({key: v}) for v in _as_list(value)]))
+    if operator == FilterOperator.CONTAINS:
+        # the metadata value is a list
+        return data.contains({key: [value]})
+    if operator == FilterOperator.TEXT_MATCH:
+        return data[key].astext.contains(str(value), autoescape=True)
+    # compared as JSONB values, numbers as numbers
+    if operator == FilterOperator.GT:
+        return data[key] > value
+    if operator == FilterOperator.GTE:
+        return data[key] >= value
+    if operator == FilterOperator.LT:
+        return data[key] < value
+    if operator == FilterOperator.LTE:
+        return data[key] <= value
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+def _source_filter_to_sql(value: Any, operator: FilterOperator) -> ColumnElement[bool]:
+    if operator in (FilterOperator.EQ, FilterOperator.NE):
+        source_chunks = select(ChunkSource.chunk_id).where(ChunkSource.source_id == value)
+    elif operator in (FilterOperator.IN, FilterOperator.NIN):
+        source_chunks = select(ChunkSource.chunk_id).where(ChunkSource.source_id.in_(_as_list(value)))
+    else:
+        raise ValueError(f"Unsupported filter operator for source_id: {operator}")
+    if operator in (FilterOperator.EQ, FilterOperator.IN):
+        return Chunk.id.in_(source_chunks)
+    return Chunk.id.not_in(source_chunks)
+
+
+def _as_list(value: Union[Any, list]) -> list:
+    return value if isinstance(value, list) else [value]
@@ -0,0 +1,59 @@
+"""On-disk HTTP cache of the crawled pages, used to revalidate the pages on re-crawls."""
+
+import sqlite3
+import threading
+import zlib
+from typing import NamedTuple, Optional
+
+
+class CachedPage(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content: bytes
+
+
+class HttpCache:
+    """SQLite backed cache of the crawled pages.
+
+    Entries are scoped by a namespace (the org), since a page that didn't change for one org may have never been
+    stored by another. Writes are persisted only on `commit`, so the caller decides when a page counts as stored.
+    """
+
+    def __init__(self, path: str, namespace: str) -> None:
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS page ("
+                "namespace TEXT NOT NULL, url TEXT NOT NULL, etag TEXT, last_modified TEXT, content BLOB NOT NULL, "
+                "PRIMARY KEY (namespace, url))"
+            )
+            self._connection.commit()
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified, content FROM page WHERE namespace = ? AND url = ?",
+                (self.namespace, url)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content = row
+        return CachedPage(etag, last_modified, zlib.decompress(content))
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], content: bytes) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO page (namespace, url, etag, last_modified, content) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, url, etag, last_modified, zlib.compress(content))
+            )
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        """Close the cache, uncommitted entries are discarded"""
+        with self._lock:
+            self._connection.close()
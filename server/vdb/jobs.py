@@ -0,0 +1,157 @@
+"""
+Queue of the ingestion jobs, stored in Postgres: archiving URLs, files or text in the knowledge base of an org.
+
+Jobs are enqueued in the transaction of the caller and run by the workers of `worker.py`. A worker claims a job with
+`SELECT ... FOR UPDATE SKIP LOCKED`, so that workers never wait for each other, and runs at most
+JOB_MAX_RUNNING_PER_ORG jobs of an org at once. A failed job is retried with an exponential backoff, a job whose
+worker died (no heartbeat for JOB_LEASE) is taken over by another worker.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session
+
+from db import SESSION_ARGUMENTS, db
+from db.models import IngestionJob, Org
+from settings import app_settings
+from vdb.utils import archive_files, archive_text, archive_urls
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_TASKS: Dict[str, Callable[..., None]] = {
+    "urls": archive_urls,
+    "files": archive_files,
+    "text": archive_text,
+}
+
+
+def enqueue(kind: str, **params: Any) -> IngestionJob:
+    """Queue a job of the current org, in the transaction of the session: it runs once the caller commits
+
+    :param kind: "urls", "files" or "text"
+    :param params: keyword arguments of the archive function of the kind, JSON serializable
+    """
+    if kind not in _TASKS:
+        raise ValueError(f"Unknown ingestion job kind: {kind}")
+    job = IngestionJob(org_id=Org.current.get().id, kind=kind, params=params, status=QUEUED)
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def claim() -> Optional[IngestionJob]:
+    """Mark the next job that can run as running, None when there is none"""
+    with Session(db.engine, **SESSION_ARGUMENTS) as session, session.begin():
+        candidates = session.execute(
+            select(IngestionJob)
+            .where(or_(
+                (IngestionJob.status == QUEUED) & (IngestionJob.run_after <= func.now()),
+                (IngestionJob.status == RUNNING) & (IngestionJob.heartbeat_at < _lease_expiry()),
+            ))
+            .order_by(IngestionJob.run_after)
+            .limit(10)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        for job in candidates:
+            # claims of the jobs of an org are serialized until the end of the transaction
+            if not session.scalar(select(func.pg_try_advisory_xact_lock(func.hashtext(str(job.org_id))))):
+                continue
+            if job.status == RUNNING and job.attempts >= app_settings.JOB_MAX_ATTEMPTS:
+                # e.g. the job kills its workers
+                job.status, job.error, job.finished_at = FAILED, "Lost its worker", datetime.utcnow()
+                continue
+            # a job taken over counts against the limit too, its lost run isn't running any more
+            if _running_count(session, job.org_id) >= app_settings.JOB_MAX_RUNNING_PER_ORG:
+                continue
+            if job.status == RUNNING:
+                logger.warning(f"Ingestion job {job.id} lost its worker, running it again")
+            job.status = RUNNING
+            job.attempts += 1
+            job.started_at = job.heartbeat_at = datetime.utcnow()
+            job.progress = None
+            return job
+    return None
+
+
+def run(job: IngestionJob) -> None:
+    """Run the claimed job in the current app context, record its outcome"""
+    org = db.session.get(Org, job.org_id)
+    Org.current.set(org)
+    heartbeat = _Heartbeat(job.id)
+    heartbeat.start()
+    try:
+        _TASKS[job.kind](**job.params, on_progress=lambda message: _set_progress(job.id, message))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Ingestion job {job.id} failed, attempt {job.attempts}")
+        _fail(job, e)
+    else:
+        _update(job.id, status=SUCCEEDED, finished_at=datetime.utcnow(), error=None)
+        logger.info(f"Ingestion job {job.id} succeeded")
+    finally:
+        heartbeat.stop()
+
+
+def _fail(job: IngestionJob, error: Exception) -> None:
+    if job.attempts < app_settings.JOB_MAX_ATTEMPTS:
+        delay = app_settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        _update(job.id, status=QUEUED, error=repr(error), run_after=datetime.utcnow() + timedelta(seconds=delay))
+    else:
+        _update(job.id, status=FAILED, error=repr(error), finished_at=datetime.utcnow())
+
+
+def _set_progress(job_id, message: str) -> None:
+    _update(job_id, progress=message, heartbeat_at=datetime.utcnow())
+
+
+def _update(job_id, **values: Any) -> None:
+    # committed on its own, whatever happens to the transaction of the job
+    with Session(db.engine) as session, session.begin():
+        session.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(**values))
+
+
+def _running_count(session: Session, org_id) -> int:
+    return session.scalar(
+        select(func.count())
+        .select_from(IngestionJob)
+        .where(IngestionJob.org_id == org_id,
+               IngestionJob.status == RUNNING,
+               IngestionJob.heartbeat_at >= _lease_expiry())
+    )
+
+
+def _lease_expiry() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=app_settings.JOB_LEASE)
+
+
+class _Heartbeat(threading.Thread):
+    """Keeps the lease of a running job, crawling may go for long without any progress"""
+
+    def __init__(self, job_id):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.app = current_app._get_current_object()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(app_settings.JOB_LEASE / 3):
+            try:
+                with self.app.app_context():
+                    _update(self.job_id, heartbeat_at=datetime.utcnow())
+            except Exception:
+                logger.exception(f"Heartbeat of ingestion job {self.job_id} failed")
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -0,0 +1,130 @@
+"""
+CPU bound stages of the ingestion: parsing the crawled pages, cleaning the text and splitting it into nodes.
+
+They run in a pool of INGESTION_PROCESSES processes shared by the ingestions of the process, so that big crawls use
+all the cores while the crawler keeps fetching and the embedding and insert stages wait on the network. The crawler
+parses each page in the pool as soon as it is fetched, documents are cleaned and split in batches of
+INGESTION_TASK_SIZE. With INGESTION_PROCESSES=1 everything runs in the ingesting process.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import reduce
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, Document
+from unstructured.cleaners.core import clean_bullets, clean_dashes, clean_extra_whitespace, \
+    clean_non_ascii_chars, clean_ordered_bullets, clean_trailing_punctuation, \
+    group_broken_paragraphs, \
+    replace_unicode_quotes
+
+from settings import app_settings
+from vdb.service_context import get_service_context
+
+logger = logging.getLogger(__name__)
+
+_CLEANERS = [
+    clean_bullets,
+    clean_dashes,
+    clean_extra_whitespace,
+    clean_non_ascii_chars,  # TODO: test if it removes non-latin characters
+    clean_ordered_bullets,
+    clean_trailing_punctuation,
+    group_broken_paragraphs,
+    replace_unicode_quotes
+]
+
+_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def clean_text(text: str) -> str:
+    if not text:
+        return text
+    # Apply each cleaner function to the text in sequence
+    return reduce(lambda x, cleaner: cleaner(x), _CLEANERS, text)
+
+
+def get_executor() -> Optional[Executor]:
+    """The process pool of the ingestion, None when it runs in the ingesting process"""
+    global _executor
+    processes = _processes()
+    if processes <= 1:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # forking would copy the threads and connection pools of the app, the processes start clean instead
+                _executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _processes() -> int:
+    return app_settings.INGESTION_PROCESSES or os.cpu_count() or 1
+
+
+def reset_executor() -> None:
+    """Drop the pool after one of its processes died, the next ingestion starts a new one"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def clean_documents(documents: Iterable[Document]) -> Iterator[Document]:
+    """Clean the text of the documents, in the order of the documents"""
+    yield from _map(_clean_documents, documents)
+
+
+def split_documents(documents: Iterable[Document]) -> Iterator[BaseNode]:
+    """Split the documents into nodes with the transformations of the service context, in the order of the documents"""
+    yield from _map(_split_documents, documents)
+
+
+def _map(func: Callable[[Sequence[Document]], list], documents: Iterable[Document]) -> Iterator:
+    batches = _batched(documents, app_settings.INGESTION_TASK_SIZE)
+    executor = get_executor()
+    if executor is None:
+        yield from chain.from_iterable(map(func, batches))
+        return
+    # unlike Executor.map, reads the documents as the batches are done rather than all of them up front
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append(executor.submit(func, batch))
+            if len(pending) > 2 * _processes():
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    except BrokenProcessPool:
+        reset_executor()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _clean_documents(documents: Sequence[Document]) -> List[Document]:
+    for document in documents:
+        document.text = clean_text(document.text)
+    return list(documents)
+
+
+def _split_documents(documents: Sequence[Document]) -> List[BaseNode]:
+    # the pool processes build their own service context
+    return run_transformations(documents, get_service_context().transformations)
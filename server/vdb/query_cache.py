@@ -0,0 +1,92 @@
+"""
+Cache of the query embeddings, the support bot sees the same questions again and again.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from array import array
+from hashlib import sha256
+from typing import Optional
+
+import redis
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+
+from db.models import Org
+from settings import app_settings
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryEmbeddingCache:
+    """LRU cache of the query embeddings with a time to live, optionally backed by Redis to share it between workers
+
+    The local cache is always checked first. Redis errors are logged and treated as a miss, the cache never fails
+    a search.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, redis_client: Optional[redis.Redis] = None):
+        self.ttl = ttl
+        self._local: LRUCache[str, array] = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._redis = redis_client
+
+    def get(self, key: str) -> Optional[Embedding]:
+        embedding = self._local.get(key)
+        if embedding is None and self._redis is not None:
+            try:
+                value = self._redis.get(key)
+            except redis.RedisError as e:
+                logger.warning(f"Query embedding cache is unavailable: {e}")
+                value = None
+            if value is not None:
+                embedding = array("d")
+                embedding.frombytes(value)
+                self._local.set(key, embedding)
+        return embedding.tolist() if embedding is not None else None
+
+    def set(self, key: str, embedding: Embedding) -> None:
+        # an array takes a fraction of the memory of a list of floats
+        value = array("d", embedding)
+        self._local.set(key, value)
+        if self._redis is not None:
+            try:
+                self._redis.set(key, value.tobytes(), ex=int(self.ttl))
+            except redis.RedisError as e:
+                logger.warning(f"Query embedding cache is unavailable: {e}")
+
+
+def _create_cache() -> QueryEmbeddingCache:
+    redis_client = None
+    if app_settings.QUERY_EMBEDDING_CACHE_REDIS:
+        redis_client = redis.Redis(host=app_settings.CACHE_HOST, port=app_settings.CACHE_PORT,
+                                   socket_timeout=1.0, socket_connect_timeout=1.0)
+    return QueryEmbeddingCache(maxsize=app_settings.QUERY_EMBEDDING_CACHE_SIZE,
+                               ttl=app_settings.QUERY_EMBEDDING_CACHE_TTL,
+                               redis_client=redis_client)
+
+
+_cache = _create_cache()
+
+
+def normalize_query(query: str) -> str:
+    """Questions differing only by case, spacing or the final punctuation share their embedding"""
+    return _WHITESPACE.sub(" ", query).strip().rstrip("?!. ").casefold()
+
+
+def get_query_embedding(query: str, embed_model: BaseEmbedding) -> Embedding:
+    """Embed the query with the model, or take the embedding of the same query from the cache"""
+    if app_settings.QUERY_EMBEDDING_CACHE_SIZE <= 0:
+        return embed_model.get_query_embedding(query)
+
+    text_hash = sha256(normalize_query(query).encode()).hexdigest()
+    # a model may output several dimensions
+    model = f"{embed_model.model_name}:{getattr(embed_model, 'dimensions', None) or ''}"
+    key = f"query-embedding:{Org.current.get().id}:{model}:{text_hash}"
+    embedding = _cache.get(key)
+    if embedding is None:
+        embedding = embed_model.get_query_embedding(query)
+        _cache.set(key, embedding)
+    return embedding
@@ -0,0 +1,127 @@
+"""
+Re-embedding of the chunks of an org with another embedding model, e.g. fewer dimensions of text-embedding-3-*.
+
+The org keeps being searched and fed with its current model while its chunks are re-embedded into
+`Chunk.next_embedding`, one committed batch at a time. The model of these embeddings is recorded on the org, a job
+started with another model discards them rather than taking them as done. The switch to the new model is a single transaction, with the
+org locked so that no chunk is added with the previous model meanwhile.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from sqlalchemy import select, text, update
+
+from db import db
+from db.models import Chunk, Org, chunk_embedding_index_name, embedding_indexes
+from settings import app_settings
+from vdb import answer_cache
+from vdb.embeddings import get_embedding_client
+
+logger = logging.getLogger(__name__)
+
+_QUANTIZATIONS = (None, "halfvec", "binary")  # the values of VDB_QUANTIZATION
+
+
+def reembed(model_name: Optional[str] = None, dim: Optional[int] = None, batch_size: Optional[int] = None) -> int:
+    """Move the current org to the embedding model, the one of the settings by default
+
+    Commits as it goes, the job can be interrupted and started again with the same model.
+
+    :return: number of re-embedded chunks
+    """
+    model_name = model_name or app_settings.EMBEDDING_MODEL
+    dim = dim or app_settings.EMBEDDING_DIM
+    batch_size = batch_size or app_settings.REEMBED_BATCH_SIZE
+    org = Org.current.get()
+    org_id = org.id
+    if (org.embedding_model, org.embedding_dim) == (model_name, dim):
+        logger.info(f"Org {org_id} already uses {model_name} ({dim})")
+        return 0
+    create_embedding_indexes(dim)
+    if (org.next_embedding_model, org.next_embedding_dim) != (model_name, dim):
+        # the embeddings of an interrupted job with another model
+        org = _lock_org(org_id)
+        db.session.execute(
+            update(Chunk)
+            .where(Chunk.org_id == org_id, Chunk.next_embedding.is_not(None))
+            .values(next_embedding=None)
+        )
+        org.next_embedding_model, org.next_embedding_dim = model_name, dim
+        db.session.commit()
+
+    count = 0
+    while True:
+        while batch := _reembed_batch(org_id, model_name, dim, batch_size):
+            count += batch
+            db.session.commit()
+            logger.info(f"{count} chunks of org {org_id} re-embedded with {model_name} ({dim})")
+
+        org = _lock_org(org_id)
+        if (org.next_embedding_model, org.next_embedding_dim) != (model_name, dim):
+            raise RuntimeError(f"Org {org_id} is being re-embedded with {org.next_embedding_model} by another job")
+        # the chunks added since the last batch, embedded with the org locked so that ingestion waits: at most one
+        # batch, more and the lock is released while they are re-embedded like the others
+        batch = _reembed_batch(org_id, model_name, dim, batch_size)
+        count += batch
+        if batch < batch_size:
+            break
+        db.session.commit()
+
+    db.session.execute(
+        update(Chunk)
+        .where(Chunk.org_id == org_id)
+        .values(embedding=Chunk.next_embedding, next_embedding=None)
+    )
+    org.embedding_model, org.embedding_dim = model_name, dim
+    org.next_embedding_model, org.next_embedding_dim = None, None
+    answer_cache.invalidate(org_id)
+    db.session.commit()
+    logger.info(f"Org {org_id} switched to {model_name} ({dim}), {count} chunks re-embedded")
+    return count
+
+
+def create_embedding_indexes(dim: int) -> None:
+    """Create the indexes of the embeddings of the dimension searched with VDB_QUANTIZATION, without blocking writes
+
+    The chunk indexes of the other quantizations are dropped, run it again after changing VDB_QUANTIZATION.
+    """
+    quantization = app_settings.VDB_QUANTIZATION
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for index in embedding_indexes(dim, quantization):
+            index.dialect_options["postgresql"]["concurrently"] = True
+            try:
+                index.create(connection, checkfirst=True)
+            finally:
+                index.dialect_options["postgresql"]["concurrently"] = False
+        for other in _QUANTIZATIONS:
+            if other != quantization:
+                name = chunk_embedding_index_name(dim, other)
+                connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "public"."{name}"'))
+
+
+def _lock_org(org_id) -> Org:
+    return db.session.execute(
+        select(Org).where(Org.id == org_id).with_for_update().execution_options(populate_existing=True)
+    ).scalar_one()
+
+
+def _reembed_batch(org_id, model_name: str, dim: int, batch_size: int) -> int:
+    stmt = select(Chunk.id, Chunk.data). \
+        where(Chunk.org_id == org_id, Chunk.next_embedding.is_(None)). \
+        limit(batch_size)
+    rows = db.session.execute(stmt).all()
+    if not rows:
+        return 0
+    # the text the chunks were embedded from in the first place, metadata included
+    texts = [metadata_dict_to_node(data).get_content(metadata_mode=MetadataMode.EMBED) for _, data in rows]
+    embeddings = get_embedding_client(model_name, dim).embed(texts)
+    db.session.execute(
+        update(Chunk),
+        [{"id": chunk_id, "next_embedding": embedding} for (chunk_id, _), embedding in zip(rows, embeddings)],
+    )
+    return len(rows)
@@ -0,0 +1,65 @@
+"""
+Registry of the LlamaIndex objects used to search the knowledge base of an org.
+
+Building an index and its retrievers is pure framework overhead, they are built once per org and shared by the
+requests of the org. The org is always the current one, `Org.current`.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from llama_index.core.indices.vector_store import VectorIndexRetriever, VectorStoreIndex
+from llama_index.core.service_context import ServiceContext
+from llama_index.core.vector_stores import MetadataFilters
+
+from db.models import Org
+from settings import app_settings
+from utils.cache import LRUCache
+from vdb.service_context import get_service_context
+from vdb.store import ChunkVectorStore
+
+
+class OrgIndex:
+    """The index of an org and its retrievers, one per search configuration"""
+
+    def __init__(self, service_context: ServiceContext):
+        self.index = VectorStoreIndex.from_vector_store(vector_store=ChunkVectorStore(),
+                                                        service_context=service_context)
+        self._retrievers: Dict[Tuple, VectorIndexRetriever] = {}
+        self._lock = threading.Lock()
+
+    def get_retriever(self, top_k: int, search_kwargs: Dict[str, Any],
+                      filters: Optional[MetadataFilters] = None) -> VectorIndexRetriever:
+        key = (top_k, tuple(sorted(search_kwargs.items())), filters.json() if filters else None)
+        with self._lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                retriever = VectorIndexRetriever(index=self.index, similarity_top_k=top_k,
+                                                 vector_store_query_mode=app_settings.VDB_QUERY_MODE,
+                                                 sparse_top_k=app_settings.VDB_HYBRID_CANDIDATES,
+                                                 filters=filters,
+                                                 vector_store_kwargs=search_kwargs)
+                self._retrievers[key] = retriever
+            return retriever
+
+
+_indexes: LRUCache[Any, OrgIndex] = LRUCache(maxsize=app_settings.VDB_INDEX_CACHE_SIZE)
+
+
+def get_org_index() -> OrgIndex:
+    """The index of the current org"""
+    return _indexes.get_or_set(Org.current.get().id, lambda: OrgIndex(get_service_context()))
+
+
+def get_retriever(top_k: int, filters: Optional[MetadataFilters] = None, **search_kwargs) -> VectorIndexRetriever:
+    """A retriever of the current org"""
+    return get_org_index().get_retriever(top_k, search_kwargs, filters)
+
+
+def invalidate(org_id=None) -> None:
+    """Drop the index of the org, or of all orgs"""
+    if org_id is None:
+        _indexes.clear()
+    else:
+        _indexes.pop(org_id)
@@ -1,10 +1,11 @@
 from typing import Dict, List
 
-from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from flask import current_app
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain.pydantic_v1 import Field
 from langchain.schema import BaseRetriever, Document
+from langchain_core.runnables.config import run_in_executor
 
-from db.models import Org
 from vdb.utils import retrieve
 
 
@@ -21,15 +22,28 @@ class LlamaVectorIndexRetriever(BaseRetriever):
             self, query: str, *, run_manager: CallbackManagerForRetrieverRun
     ) -> List[Document]:
         """Get documents relevant for a query."""
-        # First, enable the context from the metadata since it was lost in the thread initialization
-        Org.current.set(self.metadata['current_org'])
-
-        # Then, retrieve the documents
+        # The retriever is shared by the requests of the org, the current org comes from the context that LangChain
+        # copies into its worker threads
         nodes = retrieve(query, **self.query_kwargs)
 
         return [Document(page_content=node.text, metadata=node.metadata)
                 for node in nodes]
 
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        """Get documents relevant for a query, without blocking the event loop (ASGI serving mode).
+
+        The vector store is synchronous, so the search runs in a worker thread. It gets its own app context, hence
+        its own database session: the tool calls of a step run concurrently and a session can't be shared between
+        threads. The connection goes back to the pool as soon as the search is done.
+        """
+        def get_relevant_documents():
+            with current_app.app_context():
+                return self._get_relevant_documents(query, run_manager=run_manager.get_sync())
+
+        return await run_in_executor(None, get_relevant_documents)
+
 
 def format_docs(docs):
     return "\n\n".join(doc.page_content + f"\nURL: {doc.metadata['URL'] if 'URL' in doc.metadata else ''}"
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import threading
+from functools import cache
+from typing import Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.service_context import ServiceContext
+from llama_index.embeddings.openai import OpenAIEmbedding, OpenAIEmbeddingModelType
+
+from db.models import Org
+from settings import app_settings
+
+_lock = threading.Lock()
+_service_context: Optional[ServiceContext] = None
+
+
+def get_service_context() -> ServiceContext:
+    """The service context of both ingestion and retrieval: chunking settings and embedding model, no LLM
+
+    Built once per process, it is immutable once built. Its embedding model is the one of the new orgs, the chunks of
+    an org are embedded with `get_embed_model`.
+    """
+    global _service_context
+    if _service_context is None:
+        with _lock:
+            if _service_context is None:
+                _service_context = ServiceContext.from_defaults(
+                    llm=None,
+                    embed_model=get_embed_model(app_settings.EMBEDDING_MODEL, app_settings.EMBEDDING_DIM),
+                    chunk_size=app_settings.CHUNK_SIZE,
+                    chunk_overlap=app_settings.CHUNK_OVERLAP,
+                )
+    return _service_context
+
+
+def get_embed_model(model_name: Optional[str] = None, dim: Optional[int] = None) -> BaseEmbedding:
+    """The given embedding model, the one of the current org by default"""
+    if model_name is None:
+        org = Org.current.get()
+        model_name = org.embedding_model or app_settings.EMBEDDING_MODEL
+        dim = org.embedding_dim or app_settings.EMBEDDING_DIM
+    return _get_embed_model(model_name, dim)
+
+
+@cache
+def _get_embed_model(model_name: str, dim: int) -> BaseEmbedding:
+    return OpenAIEmbedding(model=model_name, dimensions=embedding_dimensions(model_name, dim))
+
+
+def embedding_dimensions(model_name: str, dim: int) -> Optional[int]:
+    """The `dimensions` parameter of the embedding requests to the model"""
+    # ada-002 has a fixed dimension and rejects the parameter
+    return None if model_name == OpenAIEmbeddingModelType.TEXT_EMBED_ADA_002 else dim
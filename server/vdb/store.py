@@ -1,15 +1,17 @@
 import logging
-from typing import Any, List
+from typing import Any, Dict, Iterable, List, Set
 
-from llama_index.core.schema import BaseNode
+from llama_index.core.schema import BaseNode, TextNode
 from llama_index.core.vector_stores import VectorStoreQuery, VectorStoreQueryResult
-from llama_index.core.vector_stores.types import VectorStore
+from llama_index.core.vector_stores.types import VectorStore, VectorStoreQueryMode
 from llama_index.core.vector_stores.utils import node_to_metadata_dict, metadata_dict_to_node
-from sqlalchemy import delete
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
 
 from db import db
-from db.models import Org, Chunk
+from db.models import Org, Chunk, ChunkSource, Source
+from settings import app_settings
+from vdb import answer_cache, filters
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +20,27 @@ class ChunkVectorStore(VectorStore):
     stores_text: bool = True
 
     def __init__(self) -> None:
-        self.org: Org = Org.current.get()
+        # the store may be shared by the requests of the org (see vdb.registry), so it only keeps the org id
+        self.org_id = Org.current.get().id
+
+    @property
+    def org(self) -> Org:
+        """The org of the current request, the one of the store"""
+        org = Org.current.get()
+        if org.id != self.org_id:
+            raise RuntimeError(f"Vector store of org {self.org_id} used for org {org.id}")
+        return org
+
+    def lock_embedding_model(self) -> Org:
+        """The org with its current embedding model, locked until the end of the transaction
+
+        The chunks added in the transaction must be embedded with this model: re-embedding the chunks of the org
+        switches models with the org locked, see vdb.reembed. Lock it once the chunks are embedded, just before
+        inserting them, the switch waits for the lock.
+        """
+        stmt = select(Org).where(Org.id == self.org_id).with_for_update(read=True). \
+            execution_options(populate_existing=True)
+        return db.session.execute(stmt).scalar_one()
 
     def client(self) -> Any:
         return
@@ -28,47 +50,158 @@ class ChunkVectorStore(VectorStore):
             nodes: List[BaseNode],
             **add_kwargs: Any,
     ) -> List[str]:
-        """Add nodes with embedding to vector store."""
+        """Add nodes with embedding to vector store.
+
+        Nodes are inserted in multi-row batches, chunks that already exist in the org are skipped.
+        Pass `source_id` to link the chunks, new or existing, to their source document.
+
+        :return: ids of the inserted nodes
+        """
         ids = []
-        for node in nodes:
-            node_data = node_to_metadata_dict(
-                node, remove_text=False, flat_metadata=False
-            )
-            chunk = Chunk(
-                id=node.node_id,
-                org_id=self.org.id,
-                hash_value=node.hash,
-                embedding=node.embedding,
-                data=node_data
-            )
-            # start a savepoint for each chunk
-            try:
-                with db.session.begin_nested():
-                    db.session.add(chunk)
-                    ids.append(node.node_id)
-            except IntegrityError:
-                logger.info(f"Chunk with hash {node.hash} already exists in org {self.org.id}.")
+        batch_size = app_settings.VDB_INSERT_BATCH_SIZE
+        for start in range(0, len(nodes), batch_size):
+            ids.extend(self._add_batch(nodes[start:start + batch_size]))
+        if add_kwargs.get("source_id") is not None:
+            self._link_source(add_kwargs["source_id"], {node.hash for node in nodes})
         return ids
 
+    def _add_batch(self, nodes: List[BaseNode]) -> List[str]:
+        # the same chunk may come twice in a batch, e.g. repeated page headers
+        unique_nodes = {}
+        for node in nodes:
+            unique_nodes.setdefault(node.hash, node)
+        nodes = list(unique_nodes.values())
+        rows = [
+            {
+                "id": node.node_id,
+                "org_id": self.org.id,
+                "hash_value": node.hash,
+                "embedding": node.embedding,
+                "data": node_to_metadata_dict(node, remove_text=False, flat_metadata=False),
+            }
+            for node in nodes
+        ]
+        stmt = (
+            insert(Chunk)
+            .values(rows)
+            .on_conflict_do_nothing(constraint="org_hash_unique_together")
+            .returning(Chunk.id)
+        )
+        inserted = {str(_id) for _id in db.session.execute(stmt).scalars()}
+        if len(inserted) < len(nodes):
+            logger.info(f"{len(nodes) - len(inserted)} chunks already exist in org {self.org.id}.")
+        if inserted:
+            answer_cache.invalidate(self.org.id)
+        # keep the order of the given nodes
+        return [node.node_id for node in nodes if node.node_id in inserted]
+
+    def filter_new(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        """Leave out repeated nodes and the ones already stored in the org, looked up in a single query"""
+        if not nodes:
+            return []
+        hashes = {node.hash for node in nodes}
+        stmt = select(Chunk.hash_value).where(Chunk.org_id == self.org.id, Chunk.hash_value.in_(hashes))
+        seen_hashes = set(db.session.execute(stmt).scalars())
+
+        new_nodes = []
+        for node in nodes:
+            if node.hash not in seen_hashes:
+                seen_hashes.add(node.hash)
+                new_nodes.append(node)
+        return new_nodes
+
+    def get_sources(self, uris: Iterable[str]) -> Dict[str, Source]:
+        """Get the org's sources by URI"""
+        stmt = select(Source).where(Source.org_id == self.org.id, Source.uri.in_(list(uris)))
+        return {source.uri: source for source in db.session.execute(stmt).scalars()}
+
+    def replace_source(self, source: Source, nodes: List[BaseNode]) -> List[str]:
+        """Make the nodes the only chunks of the source, in one transaction.
+
+        The nodes with an embedding are added and the org's chunks of the nodes are linked to the source. The source
+        is unlinked from its other chunks, which are deleted unless another source still has them.
+
+        :return: ids of the inserted nodes
+        """
+        hashes = {node.hash for node in nodes}
+        with db.session.begin_nested():
+            db.session.add(source)
+            db.session.flush()
+            unlinked = db.session.execute(
+                delete(ChunkSource)
+                .where(ChunkSource.source_id == source.id,
+                       ChunkSource.chunk_id == Chunk.id,
+                       Chunk.hash_value.not_in(hashes))
+                .returning(ChunkSource.chunk_id)
+            ).scalars().all()
+            if unlinked:
+                deleted = db.session.execute(
+                    delete(Chunk)
+                    .where(Chunk.id.in_(unlinked),
+                           ~select(ChunkSource.id).where(ChunkSource.chunk_id == Chunk.id).exists())
+                )
+                if deleted.rowcount:
+                    answer_cache.invalidate(self.org.id)
+            # the nodes without embedding are already stored, e.g. by another source
+            ids = self.add([node for node in nodes if node.embedding is not None])
+            self._link_source(source.id, hashes)
+            return ids
+
+    def _link_source(self, source_id, hashes: Set[str]) -> None:
+        """Link the org's chunks of the hashes to the source"""
+        if not hashes:
+            return
+        chunks = select(func.gen_random_uuid(), Chunk.id, literal(source_id, ChunkSource.source_id.type)). \
+            where(Chunk.org_id == self.org.id, Chunk.hash_value.in_(hashes))
+        db.session.execute(
+            insert(ChunkSource)
+            .from_select(["id", "chunk_id", "source_id"], chunks)
+            .on_conflict_do_nothing(constraint="chunk_source_unique_together")
+        )
+
     def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
         """Delete node from vector store."""
         stmt = delete(Chunk).where(Chunk.id == ref_doc_id)
         db.session.execute(stmt)
+        answer_cache.invalidate(self.org.id)
 
     def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
-        """Query vector store."""
-        # Filters are not supported yet
-        chunks_with_similarities = self.org.similarity_search(
-            embedding=query.query_embedding,
-            k=query.similarity_top_k
-        )
+        """Query vector store.
+
+        Accepts `ef_search` and `probes` keyword arguments to tune the ANN index scan for this call only. Hybrid
+        queries fuse the vector search with a full-text search of the query, their scores are the fused ones.
+        Metadata filters are applied by the database, see `vdb.filters`.
+
+        The nodes of the result only have their text and URL, `get_nodes` rebuilds the whole nodes when needed.
+        """
+        where = filters.to_sql(query.filters)
+        if query.mode == VectorStoreQueryMode.HYBRID and query.query_str:
+            chunks_with_similarities = self.org.hybrid_search(
+                embedding=query.query_embedding,
+                query=query.query_str,
+                k=query.similarity_top_k,
+                candidates=query.sparse_top_k or app_settings.VDB_HYBRID_CANDIDATES,
+                ef_search=kwargs.get("ef_search"),
+                probes=kwargs.get("probes"),
+                where=where,
+                projected=True,
+            )
+        else:
+            chunks_with_similarities = self.org.similarity_search(
+                embedding=query.query_embedding,
+                k=query.similarity_top_k,
+                ef_search=kwargs.get("ef_search"),
+                probes=kwargs.get("probes"),
+                where=where,
+                projected=True,
+            )
 
         similarities = []
         ids = []
         nodes = []
         logger.info("Similarity search found the following chunks:")
         for chunk, similarity in chunks_with_similarities:
-            node = metadata_dict_to_node(chunk.data)
+            node = TextNode(id_=str(chunk.id), text=chunk.text, metadata={"URL": chunk.url} if chunk.url else {})
 
             nodes.append(node)
             similarities.append(similarity)
@@ -76,3 +209,9 @@ class ChunkVectorStore(VectorStore):
             logger.info(f"score {similarity:.2f}: {node.text}\n")
 
         return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def get_nodes(self, node_ids: List[str]) -> List[BaseNode]:
+        """The whole nodes of the org, with all their metadata and relationships"""
+        stmt = select(Chunk.data).where(Chunk.org_id == self.org.id, Chunk.id.in_(node_ids))
+        nodes = {node.node_id: node for node in map(metadata_dict_to_node, db.session.execute(stmt).scalars())}
+        return [nodes[node_id] for node_id in node_ids if node_id in nodes]
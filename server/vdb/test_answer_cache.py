@@ -0,0 +1,68 @@
+import random
+import uuid
+from unittest.mock import patch
+
+from llama_index.core.constants import DEFAULT_EMBEDDING_DIM
+from llama_index.core.schema import TextNode
+
+from db import db
+from db.models import Org
+from db.tests.factories import OrgFactory
+from vdb import answer_cache
+from vdb.store import ChunkVectorStore
+
+EMBEDDING = [random.random() for _ in range(DEFAULT_EMBEDDING_DIM)]
+
+
+@patch("vdb.answer_cache.get_query_embedding", lambda question, embed_model: EMBEDDING)
+class TestAnswerCache:
+    def test_hit(self):
+        # Arrange
+        Org.current.set(OrgFactory.create())
+        prompt_hash = answer_cache.prompt_hash("prompt")
+        answer_cache.store("How do I reset my password?", prompt_hash, "Click on 'Forgot password'")
+
+        # Act
+        answer = answer_cache.lookup("how to reset my password", prompt_hash)
+
+        # Assert
+        assert answer == "Click on 'Forgot password'"
+
+    def test_other_prompt(self):
+        # Arrange
+        Org.current.set(OrgFactory.create())
+        answer_cache.store("How do I reset my password?", answer_cache.prompt_hash("prompt"), "Click on 'Forgot'")
+
+        # Act
+        answer = answer_cache.lookup("How do I reset my password?", answer_cache.prompt_hash("edited prompt"))
+
+        # Assert
+        assert answer is None
+
+    def test_isolates_orgs(self):
+        # Arrange
+        Org.current.set(OrgFactory.create())
+        prompt_hash = answer_cache.prompt_hash("prompt")
+        answer_cache.store("How do I reset my password?", prompt_hash, "Click on 'Forgot password'")
+        Org.current.set(OrgFactory.create())
+
+        # Act
+        answer = answer_cache.lookup("How do I reset my password?", prompt_hash)
+
+        # Assert
+        assert answer is None
+
+    def test_invalidated_by_new_chunks(self):
+        # Arrange
+        Org.current.set(OrgFactory.create())
+        prompt_hash = answer_cache.prompt_hash("prompt")
+        answer_cache.store("How do I reset my password?", prompt_hash, "Click on 'Forgot password'")
+        hits = answer_cache.stats.hits
+
+        # Act
+        ChunkVectorStore().add([TextNode(id_=str(uuid.uuid4()), embedding=EMBEDDING, text="Passwords are gone")])
+        db.session.commit()
+
+        # Assert
+        assert answer_cache.lookup("How do I reset my password?", prompt_hash) is None
+        assert answer_cache.stats.hits == hits
@@ -0,0 +1,241 @@
+import asyncio
+from unittest.mock import patch
+
+import httpx
+
+from vdb.crawler import WebCrawler
+from vdb.http_cache import HttpCache
+
+PAGES = {
+    "/": '<a href="/docs">Docs</a><a href="/pricing">Pricing</a><a href="https://other.com/">Other</a>',
+    "/docs": '<a href="/docs/start">Start</a><a href="/">Home</a>',
+    "/docs/start": '<a href="/docs/advanced">Advanced</a>',
+    "/docs/advanced": 'Advanced usage',
+    "/pricing": 'Pricing',
+    "/files": '<a href="/download">Download</a><a href="/docs">Docs</a><a href="/pricing">Pricing</a>',
+}
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith(".pdf"):
+        return httpx.Response(200, headers={"Content-Type": "application/pdf"}, content=b"%PDF")
+    if request.url.path == "/download":
+        return httpx.Response(200, headers={"Content-Type": "application/octet-stream"}, content=b"binary")
+    if request.url.path not in PAGES:
+        return httpx.Response(404, text="Not found")
+    return httpx.Response(200, headers={"Content-Type": "text/html"}, text=PAGES[request.url.path])
+
+
+class MockWebCrawler(WebCrawler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = []
+
+    def _client(self) -> httpx.AsyncClient:
+        def handler(request):
+            self.requests.append(request)
+            return _handler(request)
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class LargeSiteWebCrawler(MockWebCrawler):
+    """The home page links to 60 pages"""
+
+    def _client(self) -> httpx.AsyncClient:
+        def handler(request):
+            self.requests.append(request)
+            if request.url.path == "/":
+                links = "".join(f'<a href="/page/{i}">Page {i}</a>' for i in range(60))
+                return httpx.Response(200, headers={"Content-Type": "text/html"}, text=links)
+            return httpx.Response(200, headers={"Content-Type": "text/html"}, text=f"Page {request.url.path}")
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class _EmptySitemap:
+    @staticmethod
+    def all_pages():
+        return []
+
+
+@patch("vdb.crawler.sitemap_tree_for_homepage", lambda url: _EmptySitemap())
+class TestWebCrawler:
+    def test_no_depth(self):
+        loader = MockWebCrawler()
+
+        documents = loader.load_data(urls=["https://example.com/"])
+
+        assert [document.metadata["URL"] for document in documents] == ["https://example.com/"]
+
+    def test_depth(self):
+        loader = MockWebCrawler(depth=2)
+
+        documents = loader.load_data(urls=["https://example.com/"])
+
+        assert {document.metadata["URL"] for document in documents} == {
+            "https://example.com/",
+            "https://example.com/docs",
+            "https://example.com/pricing",
+            "https://example.com/docs/start",
+        }
+        # every page is requested once and only the same host is crawled
+        assert len(loader.requests) == 4
+
+    def test_load_data_in_event_loop(self):
+        loader = MockWebCrawler(depth=1)
+
+        async def crawl():
+            return loader.load_data(urls=["https://example.com/"])
+
+        documents = asyncio.run(crawl())
+
+        assert len(documents) == 3
+
+    def test_ignored_url(self):
+        loader = MockWebCrawler(depth=1)
+
+        documents = loader.load_data(urls=["https://example.com/"], ignored_url="/pricing")
+
+        assert {document.metadata["URL"] for document in documents} == {
+            "https://example.com/",
+            "https://example.com/docs",
+        }
+
+    def test_page_budget(self):
+        loader = MockWebCrawler(depth=3, max_pages=3)
+
+        documents = loader.load_data(urls=["https://example.com/"])
+
+        assert len(documents) == 3
+        assert len(loader.requests) == 3
+
+    def test_downloadable_is_skipped(self):
+        loader = MockWebCrawler()
+
+        documents = loader.load_data(urls=["https://example.com/manual.pdf"])
+
+        assert documents == []
+        # the file is probed with HEAD and never downloaded
+        assert [request.method for request in loader.requests] == ["HEAD"]
+
+    def test_page_is_fetched_once(self):
+        loader = MockWebCrawler()
+
+        loader.load_data(urls=["https://example.com/docs"])
+
+        assert [request.method for request in loader.requests] == ["GET"]
+
+    def test_lazy_load_data(self):
+        loader = MockWebCrawler(depth=2, max_concurrency=1)
+
+        documents = list(loader.lazy_load_data(urls=["https://example.com/"]))
+
+        assert {document.metadata["URL"] for document in documents} == {
+            "https://example.com/",
+            "https://example.com/docs",
+            "https://example.com/pricing",
+            "https://example.com/docs/start",
+        }
+
+    def test_lazy_load_data_closed(self):
+        loader = LargeSiteWebCrawler(depth=1, max_concurrency=2)
+        documents = loader.lazy_load_data(urls=["https://example.com/"])
+
+        home = next(documents)
+        next(documents)
+        documents.close()
+
+        assert home.metadata["URL"] == "https://example.com/"
+        # the crawl stops when the consumer is gone, only the pages being fetched or buffered were
+        assert len(loader.requests) < 10
+
+    def test_probe_is_cached_by_extension(self):
+        loader = MockWebCrawler(max_concurrency=1)
+
+        documents = loader.load_data(urls=["https://example.com/manual.pdf", "https://example.com/guide.pdf"])
+
+        assert documents == []
+        assert len(loader.requests) == 1
+
+        # an extensionless attachment doesn't make the other extensionless URLs files
+        loader = MockWebCrawler(depth=1, max_concurrency=1)
+
+        documents = loader.load_data(urls=["https://example.com/files"])
+
+        assert {document.metadata["URL"] for document in documents} == {
+            "https://example.com/files",
+            "https://example.com/docs",
+            "https://example.com/pricing",
+        }
+
+
+def _revalidating_handler(request: httpx.Request) -> httpx.Response:
+    if request.headers.get("If-None-Match") == '"v1"':
+        return httpx.Response(304)
+    response = _handler(request)
+    response.headers["ETag"] = '"v1"'
+    return response
+
+
+class RevalidatingWebCrawler(MockWebCrawler):
+    def _client(self) -> httpx.AsyncClient:
+        def handler(request):
+            self.requests.append(request)
+            return _revalidating_handler(request)
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@patch("vdb.crawler.sitemap_tree_for_homepage", lambda url: _EmptySitemap())
+class TestWebCrawlerCache:
+    def test_unchanged_pages_are_skipped(self, tmp_path):
+        cache = HttpCache(str(tmp_path / "cache.sqlite3"), namespace="org")
+        RevalidatingWebCrawler(depth=1, cache=cache).load_data(urls=["https://example.com/"])
+        cache.commit()
+        loader = RevalidatingWebCrawler(depth=1, cache=cache)
+
+        documents = loader.load_data(urls=["https://example.com/"])
+
+        assert documents == []
+        # links of the unchanged pages are still followed
+        assert len(loader.requests) == 3
+        assert all(request.headers["If-None-Match"] == '"v1"' for request in loader.requests)
+
+    def test_uncommitted_pages_are_fetched_again(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        cache = HttpCache(path, namespace="org")
+        RevalidatingWebCrawler(cache=cache).load_data(urls=["https://example.com/"])
+        cache.close()
+
+        documents = RevalidatingWebCrawler(cache=HttpCache(path, namespace="org")).load_data(
+            urls=["https://example.com/"])
+
+        assert len(documents) == 1
+
+    def test_lazy_load_data_caches_stored_pages(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        cache = HttpCache(path, namespace="org")
+        loader = RevalidatingWebCrawler(depth=1, cache=cache)
+        list(loader.lazy_load_data(urls=["https://example.com/"]))
+
+        loader.cache_pages(["https://example.com/docs"])
+        cache.commit()
+
+        documents = RevalidatingWebCrawler(depth=1, cache=HttpCache(path, namespace="org")).load_data(
+            urls=["https://example.com/"])
+        assert {document.metadata["URL"] for document in documents} == {
+            "https://example.com/",
+            "https://example.com/pricing",
+        }
+
+    def test_cache_is_scoped_by_namespace(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        cache = HttpCache(path, namespace="org")
+        RevalidatingWebCrawler(cache=cache).load_data(urls=["https://example.com/"])
+        cache.commit()
+
+        documents = RevalidatingWebCrawler(cache=HttpCache(path, namespace="other org")).load_data(
+            urls=["https://example.com/"])
+
+        assert len(documents) == 1
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import openai
+import pytest
+
+from settings import app_settings
+from vdb.embeddings import EmbeddingClient, TokenBucket
+
+
+class FakeOpenAI:
+    """Embeds a text as [its length], fails with the given errors first"""
+
+    def __init__(self, errors=()):
+        self.requests = []
+        self.errors = list(errors)
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, input, model, **kwargs):
+        self.requests.append((input, kwargs))
+        if self.errors:
+            raise self.errors.pop(0)
+        # the API doesn't promise the order of the embeddings
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1])
+
+
+def _rate_limit_error():
+    response = httpx.Response(429, headers={"retry-after": "0"},
+                              request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class TestEmbeddingClient:
+    def test_embed_in_order(self):
+        client = FakeOpenAI()
+        texts = [f"text {'a' * i}" for i in range(10)]
+
+        with patch.object(app_settings, "EMBEDDING_BATCH_SIZE", 3):
+            embeddings = EmbeddingClient("text-embedding-3-small", 256, client=client).embed(texts)
+
+        assert embeddings == [[float(len(text))] for text in texts]
+        assert [len(texts) for texts, _ in client.requests] == [3, 3, 3, 1]
+        assert all(kwargs == {"dimensions": 256} for _, kwargs in client.requests)
+
+    def test_batches_are_token_bounded(self):
+        client = FakeOpenAI()
+        texts = ["one two three four five"] * 5 + ["one\ntwo"]
+
+        with patch.object(app_settings, "EMBEDDING_BATCH_TOKENS", 12):
+            EmbeddingClient("text-embedding-ada-002", 1536, client=client).embed(texts)
+
+        assert [texts for texts, _ in client.requests][-1] == ["one two three four five", "one two"]
+        assert [len(texts) for texts, _ in client.requests] == [2, 2, 2]
+        # ada-002 doesn't take the dimensions
+        assert all(kwargs == {} for _, kwargs in client.requests)
+
+    def test_embed_nothing(self):
+        client = FakeOpenAI()
+
+        assert EmbeddingClient("text-embedding-3-small", 256, client=client).embed([]) == []
+        assert client.requests == []
+
+    def test_rate_limit_is_retried(self):
+        client = FakeOpenAI(errors=[_rate_limit_error(), openai.APIConnectionError(request=httpx.Request(
+            "POST", "https://api.openai.com/v1/embeddings"))])
+        bucket = TokenBucket(1_000_000)
+
+        with patch("vdb.embeddings.time.sleep") as sleep:
+            embeddings = EmbeddingClient("text-embedding-3-small", 256, client=client, bucket=bucket).embed(["text"])
+
+        assert embeddings == [[4.0]]
+        assert len(client.requests) == 3
+        # the delay asked by the API, then a backoff
+        assert sleep.call_args_list[0].args == (0.0,)
+        assert 0 < sleep.call_args_list[-1].args[0] <= 4
+
+    def test_retries_are_bounded(self):
+        client = FakeOpenAI(errors=[_rate_limit_error()] * 3)
+
+        with patch.object(app_settings, "EMBEDDING_MAX_RETRIES", 2), pytest.raises(openai.RateLimitError):
+            EmbeddingClient("text-embedding-3-small", 256, client=client).embed(["text"])
+
+        assert len(client.requests) == 3
+
+
+class TestTokenBucket:
+    def test_acquire_waits_for_the_budget(self):
+        bucket = TokenBucket(6000)
+        bucket.acquire(6000)
+
+        def sleep(seconds):
+            bucket._updated -= seconds
+
+        with patch("vdb.embeddings.time.sleep", side_effect=sleep) as mock_sleep:
+            bucket.acquire(200)
+
+        # 100 tokens refilled per second
+        assert mock_sleep.call_args_list[0].args[0] == pytest.approx(2.0, abs=0.01)
+
+    def test_empty(self):
+        bucket = TokenBucket(6000)
+
+        bucket.empty()
+
+        assert bucket._tokens == 0
@@ -0,0 +1,50 @@
+import pytest
+from llama_index.core.vector_stores import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
+from sqlalchemy.dialects import postgresql
+
+from vdb.filters import to_sql
+
+
+class TestToSql:
+    def test_no_filters(self):
+        assert to_sql(None) is None
+        assert to_sql(MetadataFilters(filters=[])) is None
+
+    def test_equality_is_containment(self):
+        # Arrange
+        filters = MetadataFilters(filters=[MetadataFilter(key="type", value="faq")])
+
+        # Act
+        predicate = to_sql(filters)
+
+        # Assert
+        assert "@>" in str(predicate.compile(dialect=postgresql.dialect()))
+        assert predicate.right.value == {"type": "faq"}
+
+    def test_conditions(self):
+        # Arrange
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(key="source_id", value="a7b9c1f0-0000-0000-0000-000000000000"),
+                MetadataFilters(filters=[MetadataFilter(key="year", value=2023, operator=FilterOperator.GTE),
+                                         MetadataFilter(key="URL", value="/docs/", operator=FilterOperator.TEXT_MATCH)],
+                                condition=FilterCondition.OR),
+            ]
+        )
+
+        # Act
+        sql = str(to_sql(filters).compile(dialect=postgresql.dialect()))
+
+        # Assert
+        assert sql.startswith("chunk.id IN (SELECT chunk_source.chunk_id")
+        assert " AND (" in sql and " OR " in sql
+        assert "-> " in sql and ">= " in sql
+        assert "->> " in sql and "LIKE" in sql
+
+    def test_unsupported_column_operator(self):
+        # Arrange
+        filters = MetadataFilters(filters=[MetadataFilter(key="source_id", value="a", operator=FilterOperator.GT)])
+
+        # Act & Assert
+        with pytest.raises(ValueError):
+            to_sql(filters)
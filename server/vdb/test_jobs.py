@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import delete
+
+from db import db
+from db.models import IngestionJob, Org
+from db.tests.factories import OrgFactory
+from vdb import jobs
+
+
+class TestJobs:
+    def setup_method(self):
+        # claims look at the jobs of all orgs
+        db.session.execute(delete(IngestionJob))
+        db.session.commit()
+
+    @staticmethod
+    def _enqueue(org: Org, **params) -> IngestionJob:
+        Org.current.set(org)
+        job = jobs.enqueue("text", text="Some text", **params)
+        db.session.commit()
+        return job
+
+    def test_claim(self):
+        # Arrange
+        job = self._enqueue(OrgFactory.create())
+
+        # Act
+        claimed = jobs.claim()
+
+        # Assert
+        assert claimed.id == job.id
+        assert (claimed.status, claimed.attempts) == (jobs.RUNNING, 1)
+        assert jobs.claim() is None
+
+    def test_claim_limits_running_jobs_per_org(self):
+        # Arrange
+        org, other_org = OrgFactory.create(), OrgFactory.create()
+        first = self._enqueue(org)
+        self._enqueue(org)
+        other = self._enqueue(other_org)
+
+        # Act
+        claimed = [jobs.claim(), jobs.claim(), jobs.claim()]
+
+        # Assert
+        assert [job.id for job in claimed[:2]] == [first.id, other.id]
+        assert claimed[2] is None
+
+    def test_claim_lost_job(self):
+        # Arrange
+        job = self._enqueue(OrgFactory.create())
+        jobs.claim()
+        jobs._update(job.id, heartbeat_at=datetime.utcnow() - timedelta(hours=1))
+
+        # Act
+        claimed = jobs.claim()
+
+        # Assert
+        assert (claimed.id, claimed.attempts) == (job.id, 2)
+
+    def test_claim_lost_job_limits_running_jobs_per_org(self):
+        # Arrange: another job of the org started while the first one lost its worker
+        org = OrgFactory.create()
+        lost = self._enqueue(org)
+        jobs.claim()
+        jobs._update(lost.id, heartbeat_at=datetime.utcnow() - timedelta(hours=1))
+        running = self._enqueue(org)
+        jobs._update(running.id, status=jobs.RUNNING, heartbeat_at=datetime.utcnow())
+
+        # Act
+        claimed = jobs.claim()
+
+        # Assert
+        assert claimed is None
+
+    @patch.dict(jobs._TASKS, {"text": lambda text, on_progress: on_progress(f"Stored {text}")})
+    def test_run(self):
+        # Arrange
+        job = self._enqueue(OrgFactory.create())
+
+        # Act
+        jobs.run(jobs.claim())
+
+        # Assert
+        db.session.refresh(job)
+        assert (job.status, job.progress, job.error) == (jobs.SUCCEEDED, "Stored Some text", None)
+        assert job.finished_at is not None
+
+    @patch.dict(jobs._TASKS, {"text": lambda text, on_progress: 1 / 0})
+    def test_run_retries(self):
+        # Arrange
+        job = self._enqueue(OrgFactory.create())
+
+        # Act
+        jobs.run(jobs.claim())
+
+        # Assert
+        db.session.refresh(job)
+        assert (job.status, job.attempts) == (jobs.QUEUED, 1)
+        assert "ZeroDivisionError" in job.error
+        assert job.run_after > datetime.now(job.run_after.tzinfo)
+        assert jobs.claim() is None
+
+    @patch("vdb.jobs.app_settings.JOB_MAX_ATTEMPTS", 1)
+    @patch.dict(jobs._TASKS, {"text": lambda text, on_progress: 1 / 0})
+    def test_run_fails(self):
+        # Arrange
+        job = self._enqueue(OrgFactory.create())
+
+        # Act
+        jobs.run(jobs.claim())
+
+        # Assert
+        db.session.refresh(job)
+        assert job.status == jobs.FAILED
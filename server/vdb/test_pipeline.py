@@ -0,0 +1,55 @@
+from unittest.mock import patch
+
+import pytest
+from llama_index.core.schema import Document
+
+from settings import app_settings
+from vdb import pipeline
+from vdb.test_crawler import MockWebCrawler, _EmptySitemap
+
+
+@pytest.fixture(params=[1, 2], ids=["in process", "process pool"])
+def processes(request):
+    with patch.object(app_settings, "INGESTION_PROCESSES", request.param), \
+            patch.object(app_settings, "INGESTION_TASK_SIZE", 2):
+        yield request.param
+    pipeline.reset_executor()
+
+
+class TestPipeline:
+    def test_get_executor(self, processes):
+        executor = pipeline.get_executor()
+
+        if processes == 1:
+            assert executor is None
+        else:
+            assert pipeline.get_executor() is executor
+
+    def test_clean_documents(self, processes):
+        documents = [Document(text=f"• Item {i}....", doc_id=str(i)) for i in range(5)]
+
+        cleaned = list(pipeline.clean_documents(iter(documents)))
+
+        assert [(document.doc_id, document.text) for document in cleaned] == [(str(i), f"Item {i}") for i in range(5)]
+
+    def test_split_documents(self, processes):
+        documents = [Document(text=" ".join([f"Sentence {i}."] * 500), doc_id=str(i)) for i in range(3)]
+
+        nodes = list(pipeline.split_documents(documents))
+
+        # several nodes per document, in the order of the documents
+        ref_doc_ids = [node.ref_doc_id for node in nodes]
+        assert ref_doc_ids == sorted(ref_doc_ids)
+        assert all(ref_doc_ids.count(str(i)) > 1 for i in range(3))
+
+    @patch("vdb.crawler.sitemap_tree_for_homepage", lambda url: _EmptySitemap())
+    def test_crawler_parses_in_executor(self, processes):
+        loader = MockWebCrawler(depth=1, executor=pipeline.get_executor())
+
+        documents = loader.load_data(urls=["https://example.com/"])
+
+        assert {document.metadata["URL"] for document in documents} == {
+            "https://example.com/",
+            "https://example.com/docs",
+            "https://example.com/pricing",
+        }
@@ -0,0 +1,87 @@
+import uuid
+from unittest.mock import patch
+
+import redis
+from llama_index.core import MockEmbedding
+
+from db.models import Org
+from vdb.query_cache import QueryEmbeddingCache, get_query_embedding, normalize_query
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+class BrokenRedis:
+    def get(self, key):
+        raise redis.ConnectionError("down")
+
+    def set(self, key, value, ex=None):
+        raise redis.ConnectionError("down")
+
+
+def test_normalize_query():
+    assert normalize_query("  How do I reset\n my password? ") == "how do i reset my password"
+    assert normalize_query("How do I reset my password") == "how do i reset my password"
+
+
+@patch("vdb.query_cache._cache", QueryEmbeddingCache(maxsize=10, ttl=60))
+class TestGetQueryEmbedding:
+    def test_repeated_query(self):
+        # Arrange
+        Org.current.set(Org(id=uuid.uuid4()))
+        embed_model = MockEmbedding(embed_dim=8)
+
+        # Act
+        with patch.object(MockEmbedding, "get_query_embedding", wraps=embed_model.get_query_embedding) as embed:
+            first = get_query_embedding("How do I reset my password?", embed_model)
+            second = get_query_embedding("how do i reset my password", embed_model)
+
+        # Assert
+        assert embed.call_count == 1
+        assert first == second
+
+    def test_isolates_orgs(self):
+        # Arrange
+        embed_model = MockEmbedding(embed_dim=8)
+
+        # Act
+        with patch.object(MockEmbedding, "get_query_embedding", wraps=embed_model.get_query_embedding) as embed:
+            for _ in range(2):
+                Org.current.set(Org(id=uuid.uuid4()))
+                get_query_embedding("How do I reset my password?", embed_model)
+
+        # Assert
+        assert embed.call_count == 2
+
+
+class TestQueryEmbeddingCache:
+    def test_shared_through_redis(self):
+        # Arrange
+        shared = FakeRedis()
+        worker_1 = QueryEmbeddingCache(maxsize=10, ttl=60, redis_client=shared)
+        worker_2 = QueryEmbeddingCache(maxsize=10, ttl=60, redis_client=shared)
+
+        # Act
+        worker_1.set("key", [0.1, 0.2, 0.3])
+
+        # Assert
+        assert worker_2.get("key") == [0.1, 0.2, 0.3]
+
+    def test_redis_unavailable(self):
+        # Arrange
+        cache = QueryEmbeddingCache(maxsize=10, ttl=60, redis_client=BrokenRedis())
+
+        # Act
+        cache.set("key", [0.1, 0.2, 0.3])
+
+        # Assert
+        assert cache.get("key") == [0.1, 0.2, 0.3]
+        assert cache.get("missing") is None
@@ -0,0 +1,80 @@
+import random
+import uuid
+from unittest.mock import patch
+
+from llama_index.core.constants import DEFAULT_EMBEDDING_DIM
+from llama_index.core.schema import TextNode
+from sqlalchemy import select, update
+
+from db import db
+from db.models import Chunk, Org
+from db.tests.factories import OrgFactory
+from vdb.reembed import reembed
+from vdb.store import ChunkVectorStore
+
+
+class _EmbeddingClient:
+    def __init__(self, model_name: str, dim: int):
+        self.dim = dim
+
+    def embed(self, texts):
+        return [[random.random() for _ in range(self.dim)] for _ in texts]
+
+
+@patch("vdb.reembed.create_embedding_indexes")
+@patch("vdb.reembed.get_embedding_client", _EmbeddingClient)
+class TestReembed:
+    @staticmethod
+    def _add_chunks(count: int) -> None:
+        ChunkVectorStore().add([
+            TextNode(id_=str(uuid.uuid4()), text=f"random text {i}",
+                     embedding=[random.random() for _ in range(DEFAULT_EMBEDDING_DIM)])
+            for i in range(count)
+        ])
+
+    def test_reembed(self, create_embedding_indexes):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        self._add_chunks(5)
+
+        # Act
+        count = reembed("text-embedding-3-small", 256, batch_size=2)
+
+        # Assert
+        assert count == 5
+        create_embedding_indexes.assert_called_once_with(256)
+        assert (org.embedding_model, org.embedding_dim) == ("text-embedding-3-small", 256)
+        assert (org.next_embedding_model, org.next_embedding_dim) == (None, None)
+        chunks = db.session.execute(select(Chunk).where(Chunk.org_id == org.id)).scalars().all()
+        assert all(len(chunk.embedding) == 256 and chunk.next_embedding is None for chunk in chunks)
+        assert org.similarity_search([0.5] * 256, k=3, projected=True)
+
+    def test_same_model(self, create_embedding_indexes):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        self._add_chunks(1)
+
+        # Act
+        count = reembed(org.embedding_model, org.embedding_dim)
+
+        # Assert
+        assert count == 0
+        create_embedding_indexes.assert_not_called()
+
+    def test_other_model_interrupted(self, create_embedding_indexes):
+        # Arrange: a job with another model re-embedded the chunks, then was interrupted
+        org = OrgFactory.create()
+        Org.current.set(org)
+        self._add_chunks(3)
+        org.next_embedding_model, org.next_embedding_dim = "text-embedding-3-large", 512
+        db.session.execute(update(Chunk).where(Chunk.org_id == org.id).values(next_embedding=[0.5] * 512))
+
+        # Act
+        count = reembed("text-embedding-3-small", 256, batch_size=2)
+
+        # Assert: its embeddings aren't taken for the ones of the model
+        assert count == 3
+        chunks = db.session.execute(select(Chunk).where(Chunk.org_id == org.id)).scalars().all()
+        assert all(len(chunk.embedding) == 256 for chunk in chunks)
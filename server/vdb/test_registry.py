@@ -0,0 +1,66 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from db.models import Org
+from vdb import registry
+
+
+class TestRegistry:
+    def setup_method(self):
+        registry.invalidate()
+
+    def test_retriever_is_reused(self):
+        # Arrange
+        Org.current.set(Org(id=uuid.uuid4()))
+
+        # Act
+        first = registry.get_retriever(5, ef_search=40)
+        second = registry.get_retriever(5, ef_search=40)
+        other = registry.get_retriever(10)
+
+        # Assert
+        assert first is second
+        assert other is not first
+        assert other._index is first._index
+
+    def test_isolates_orgs(self):
+        # Arrange
+        Org.current.set(Org(id=uuid.uuid4()))
+        first = registry.get_org_index()
+
+        # Act
+        Org.current.set(Org(id=uuid.uuid4()))
+        second = registry.get_org_index()
+
+        # Assert
+        assert first is not second
+        assert first.index.service_context is second.index.service_context
+
+    def test_follows_the_context(self):
+        # Arrange
+        orgs = [Org(id=uuid.uuid4()) for _ in range(4)]
+
+        def get_index(org):
+            Org.current.set(org)
+            return registry.get_org_index().index.vector_store.org_id
+
+        # Act
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            org_ids = list(executor.map(get_index, orgs))
+
+        # Assert
+        assert org_ids == [org.id for org in orgs]
+
+    def test_store_of_another_org(self):
+        # Arrange
+        Org.current.set(Org(id=uuid.uuid4()))
+        store = registry.get_org_index().index.vector_store
+
+        # Act
+        Org.current.set(Org(id=uuid.uuid4()))
+
+        # Assert
+        with pytest.raises(RuntimeError):
+            store.org
@@ -4,11 +4,11 @@ import uuid
 from langchain.embeddings import OpenAIEmbeddings
 from llama_index.core.constants import DEFAULT_EMBEDDING_DIM
 from llama_index.core.schema import TextNode
-from llama_index.core.vector_stores import VectorStoreQuery
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters, VectorStoreQuery
 from sqlalchemy import select
 
 from db import db
-from db.models import Chunk, Org
+from db.models import Chunk, ChunkSource, Org, Source
 from db.tests.factories import OrgFactory
 from vdb.store import ChunkVectorStore
 
@@ -118,6 +118,50 @@ class TestChunkVectorStore:
         # Assert
         assert query_results.nodes == []
 
+    def test_query_filters(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        embedding = self._get_random_embedding()
+        nodes = [
+            TextNode(id_=str(uuid.uuid4()), embedding=embedding, text=f"random text {i}",
+                     metadata={"URL": f"https://example.com/{path}/{i}", "type": doc_type})
+            for i, (path, doc_type) in enumerate([("docs", "guide"), ("docs", "faq"), ("blog", "faq")])
+        ]
+        chunk_vector_store = ChunkVectorStore()
+        chunk_vector_store.add(nodes)
+        filters = MetadataFilters(filters=[
+            MetadataFilter(key="type", value="faq"),
+            MetadataFilter(key="URL", value="example.com/docs/", operator=FilterOperator.TEXT_MATCH),
+        ])
+        query = VectorStoreQuery(query_embedding=embedding, similarity_top_k=3, filters=filters)
+
+        # Act
+        query_results = chunk_vector_store.query(query)
+
+        # Assert
+        assert query_results.ids == [nodes[1].node_id]
+        assert query_results.nodes[0].metadata == {"URL": "https://example.com/docs/1"}
+
+    def test_get_nodes(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        nodes = [
+            TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text=f"random text {i}",
+                     metadata={"URL": "https://example.com/docs", "title": f"Docs {i}"})
+            for i in range(2)
+        ]
+        chunk_vector_store = ChunkVectorStore()
+        chunk_vector_store.add(nodes)
+
+        # Act
+        full_nodes = chunk_vector_store.get_nodes([nodes[1].node_id, nodes[0].node_id])
+
+        # Assert
+        assert [node.node_id for node in full_nodes] == [nodes[1].node_id, nodes[0].node_id]
+        assert full_nodes[0].metadata == {"URL": "https://example.com/docs", "title": "Docs 1"}
+
     def test_add_duplicates(self):
         # Arrange
         org = OrgFactory.create()
@@ -144,5 +188,135 @@ class TestChunkVectorStore:
         for chunk in chunks:
             assert any(node_texts[i] in chunk.data["_node_content"] for i in range(len(node_texts)))
             assert str(chunk.id) in ids
-        assert len(ids) == len(nodes)
+        assert len(ids) == 2
         assert all(_id in ids for _id in [node.node_id for node in nodes])
+
+    def test_add_existing(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        existing = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(),
+                            text="random text 1")
+        chunk_vector_store = ChunkVectorStore()
+        chunk_vector_store.add([existing])
+        new = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(),
+                       text="random text 2")
+        same_as_existing = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(),
+                                    text="random text 1")
+
+        # Act
+        ids = chunk_vector_store.add([same_as_existing, new])
+
+        # Assert
+        assert ids == [new.node_id]
+        chunks = db.session.execute(select(Chunk)).scalars().all()
+        assert len(chunks) == 2
+
+    def test_filter_new(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        stored = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(),
+                          text="random text 1")
+        chunk_vector_store = ChunkVectorStore()
+        chunk_vector_store.add([stored])
+        # nodes coming from a re-crawl have no embedding yet
+        same_as_stored = TextNode(id_=str(uuid.uuid4()), text="random text 1")
+        new = TextNode(id_=str(uuid.uuid4()), text="random text 2")
+
+        # Act
+        new_nodes = chunk_vector_store.filter_new([same_as_stored, new])
+
+        # Assert
+        assert new_nodes == [new]
+
+    def test_filter_new_isolates_orgs(self):
+        # Arrange
+        Org.current.set(OrgFactory.create(name="fake company"))
+        ChunkVectorStore().add([TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(),
+                                         text="random text 1")])
+        Org.current.set(OrgFactory.create(name="real company"))
+        node = TextNode(id_=str(uuid.uuid4()), text="random text 1")
+
+        # Act
+        new_nodes = ChunkVectorStore().filter_new([node])
+
+        # Assert
+        assert new_nodes == [node]
+
+    def test_replace_source(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        chunk_vector_store = ChunkVectorStore()
+        source = Source(org_id=org.id, uri="https://example.com/docs", content_hash="v1")
+        kept = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text="kept text")
+        stale = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text="stale text")
+        chunk_vector_store.replace_source(source, [kept, stale])
+        # the page was edited: one paragraph stays, one is gone and one is new
+        source.content_hash = "v2"
+        kept_again = TextNode(id_=str(uuid.uuid4()), text="kept text")
+        new = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text="new text")
+
+        # Act
+        ids = chunk_vector_store.replace_source(source, [kept_again, new])
+
+        # Assert
+        assert ids == [new.node_id]
+        chunks = db.session.execute(select(Chunk)).scalars().all()
+        assert {chunk.hash_value for chunk in chunks} == {kept.hash, new.hash}
+        assert all(chunk.sources == [source] for chunk in chunks)
+
+    def test_replace_source_keeps_other_sources(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        chunk_vector_store = ChunkVectorStore()
+        other_source = Source(org_id=org.id, uri="https://example.com/pricing", content_hash="v1")
+        other = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text="other text")
+        chunk_vector_store.replace_source(other_source, [other])
+        source = Source(org_id=org.id, uri="https://example.com/docs", content_hash="v1")
+        node = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text="random text")
+
+        # Act
+        chunk_vector_store.replace_source(source, [node])
+
+        # Assert
+        assert [chunk.hash_value for chunk in self._source_chunks(other_source)] == [other.hash]
+        assert chunk_vector_store.get_sources(["https://example.com/docs"]) == {"https://example.com/docs": source}
+
+    def test_replace_source_keeps_shared_chunks(self):
+        # Arrange
+        org = OrgFactory.create()
+        Org.current.set(org)
+        chunk_vector_store = ChunkVectorStore()
+        footer = TextNode(id_=str(uuid.uuid4()), embedding=self._get_random_embedding(), text="footer text")
+        docs = Source(org_id=org.id, uri="https://example.com/docs", content_hash="v1")
+        pricing = Source(org_id=org.id, uri="https://example.com/pricing", content_hash="v1")
+        chunk_vector_store.replace_source(docs, [footer])
+        # stored by the docs page already
+        chunk_vector_store.replace_source(pricing, [TextNode(id_=str(uuid.uuid4()), text="footer text")])
+
+        # Act
+        # the docs page drops the footer
+        docs.content_hash = "v2"
+        chunk_vector_store.replace_source(docs, [])
+
+        # Assert
+        assert self._source_chunks(docs) == []
+        assert [chunk.hash_value for chunk in self._source_chunks(pricing)] == [footer.hash]
+
+        # Act
+        # the pricing page drops it too
+        pricing.content_hash = "v2"
+        chunk_vector_store.replace_source(pricing, [])
+
+        # Assert
+        assert db.session.execute(select(Chunk)).scalars().all() == []
+
+    @staticmethod
+    def _source_chunks(source):
+        stmt = select(Chunk). \
+            join(ChunkSource, ChunkSource.chunk_id == Chunk.id). \
+            where(ChunkSource.source_id == source.id)
+        return db.session.execute(stmt).scalars().all()
@@ -1,108 +1,201 @@
 import logging
 import os
-from functools import reduce
-from typing import Sequence, Optional
+from collections import defaultdict
+from hashlib import sha256
+from itertools import chain
+from typing import Callable, Iterable, Iterator, List, Sequence, Optional
 from typing import Union
 
-from llama_index.core.service_context import ServiceContext
 from llama_index.core.readers.file.base import SimpleDirectoryReader
 from llama_index.core.schema import Document, NodeWithScore
-from llama_index.core.storage import StorageContext
 from llama_index.core.schema import QueryBundle
-from llama_index.core.indices.vector_store import (
-    VectorStoreIndex,
-    VectorIndexRetriever
-)
-from unstructured.cleaners.core import clean_bullets, clean_dashes, clean_extra_whitespace, \
-    clean_non_ascii_chars, clean_ordered_bullets, clean_trailing_punctuation, \
-    group_broken_paragraphs, \
-    replace_unicode_quotes
+from llama_index.core.vector_stores import MetadataFilters
 
+from db import db
+from db.models import Org, Source
 from vdb.crawler import WebCrawler
+from vdb.embeddings import embed_nodes, get_embedding_client
+from vdb.http_cache import HttpCache
+from vdb.pipeline import clean_documents, clean_text, get_executor, split_documents
+from vdb.query_cache import get_query_embedding
+from vdb.registry import get_retriever
+from vdb.service_context import get_embed_model
 from vdb.store import ChunkVectorStore
 from settings import app_settings, SRC_ROOT
 
 logger = logging.getLogger(__name__)
 
+ProgressCallback = Callable[[str], None]
 
-def _clean(text: str) -> str:
-    if not text:
-        return text
-    cleaners = [
-        clean_bullets,
-        clean_dashes,
-        clean_extra_whitespace,
-        clean_non_ascii_chars,  # TODO: test if it removes non-latin characters
-        clean_ordered_bullets,
-        clean_trailing_punctuation,
-        group_broken_paragraphs,
-        replace_unicode_quotes
-    ]
-    # Apply each cleaner function to the text in sequence
-    return reduce(lambda x, cleaner: cleaner(x), cleaners, text)
-
-
-def _create_documents(documents: Sequence[Document]) -> None:
-    vector_store = ChunkVectorStore()
 
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    service_context = ServiceContext.from_defaults(
-        chunk_size=app_settings.CHUNK_SIZE, chunk_overlap=app_settings.CHUNK_OVERLAP
-    )
-    VectorStoreIndex.from_documents(documents, storage_context=storage_context,
-                                    service_context=service_context)
+def _create_documents(documents: Iterable[Document], on_progress: Optional[ProgressCallback] = None,
+                      on_stored: Optional[Callable[[List[Document]], None]] = None) -> None:
+    """Split the documents into nodes, embed the ones the org doesn't have yet and store them
+
+    The documents are read as they come, INGESTION_BATCH_SIZE at a time, and each batch is committed before the next
+    one is read: memory use doesn't grow with the number of documents, and an interrupted ingestion keeps the
+    batches it stored. The documents of a source (web page or file) must come one after the other.
 
+    Documents coming from a source replace the chunks stored for it before, documents of unchanged sources are
+    skipped before splitting.
 
-def _get_index() -> VectorStoreIndex:
+    :param on_stored: called with the documents of each batch once it is committed
+    """
+    on_progress = on_progress or _no_progress
     vector_store = ChunkVectorStore()
-    return VectorStoreIndex.from_vector_store(
-        vector_store=vector_store,
-        service_context=ServiceContext.from_defaults(llm=None)
-    )
+    documents_count = chunks_count = 0
+    for batch in _source_batches(documents, app_settings.INGESTION_BATCH_SIZE):
+        chunks_count += _create_batch(vector_store, batch, on_progress)
+        db.session.commit()
+        documents_count += len(batch)
+        if on_stored:
+            on_stored(batch)
+        on_progress(f"Stored {chunks_count} new chunks of {documents_count} documents")
+
+
+def _create_batch(vector_store: ChunkVectorStore, documents: List[Document], on_progress: ProgressCallback) -> int:
+    """Store the chunks of the documents, in the transaction of the session
+
+    :return: number of new chunks
+    """
+    documents_by_source = defaultdict(list)
+    for document in documents:
+        documents_by_source[_source_uri(document)].append(document)
+    sourceless_documents = documents_by_source.pop(None, [])
+
+    changed_sources = {}
+    sources = vector_store.get_sources(documents_by_source)
+    for uri, source_documents in documents_by_source.items():
+        content_hash = _content_hash(source_documents)
+        source = sources.get(uri) or Source(org_id=vector_store.org.id, uri=uri)
+        if source.content_hash == content_hash:
+            logger.info(f"Source {uri} didn't change, skipping.")
+            continue
+        source.content_hash = content_hash
+        for document in source_documents:
+            changed_sources[document.doc_id] = source
+
+    documents = sourceless_documents + [document for document in documents if document.doc_id in changed_sources]
+    nodes = list(split_documents(documents))
+    # embedding is the expensive part, so skip the chunks we already have before calling the API
+    new_nodes = vector_store.filter_new(nodes)
+    logger.info(f"{len(nodes) - len(new_nodes)} of {len(nodes)} chunks are already stored.")
+    on_progress(f"Embedding {len(new_nodes)} new chunks of {len(documents)} changed documents")
+    # the API calls may take minutes, they don't hold the org locked: a re-embedding would wait for them to switch
+    model = (vector_store.org.embedding_model, vector_store.org.embedding_dim)
+    embed_nodes(new_nodes, get_embedding_client(*model))
+    org = vector_store.lock_embedding_model()
+    if (org.embedding_model, org.embedding_dim) != model:
+        logger.info(f"Org {org.id} switched to {org.embedding_model} ({org.embedding_dim}), embedding again")
+        embed_nodes(new_nodes, get_embedding_client(org.embedding_model, org.embedding_dim))
+
+    nodes_by_source = defaultdict(list)
+    for node in nodes:
+        nodes_by_source[changed_sources.get(node.ref_doc_id)].append(node)
+    vector_store.add([node for node in nodes_by_source.pop(None, []) if node.embedding is not None])
+    for source in dict.fromkeys(changed_sources.values()):
+        vector_store.replace_source(source, nodes_by_source[source])
+    return len(new_nodes)
+
+
+def _source_batches(documents: Iterable[Document], size: int) -> Iterator[List[Document]]:
+    """Batches of `size` documents or so, the documents of a source are kept in the same batch"""
+    batch = []
+    for document in documents:
+        uri = _source_uri(document)
+        if len(batch) >= size and (uri is None or uri != _source_uri(batch[-1])):
+            yield batch
+            batch = []
+        batch.append(document)
+    if batch:
+        yield batch
+
 
+def _no_progress(message: str) -> None:
+    pass
 
-def archive_urls(urls: Union[str, list[str]], depth: int = 0, ignored_url: Optional[str] = None) -> None:
+
+def _source_uri(document: Document) -> Optional[str]:
+    return document.metadata.get("URL") or document.metadata.get("file_path")
+
+
+def _content_hash(documents: Sequence[Document]) -> str:
+    """Hash of the source content, a file may be loaded as several documents (e.g. PDF pages)"""
+    return sha256("".join(document.hash for document in documents).encode()).hexdigest()
+
+
+def archive_urls(urls: Union[str, list[str]], depth: int = 0, ignored_url: Optional[str] = None,
+                 on_progress: Optional[ProgressCallback] = None) -> None:
     """
     Scrape provided URLs and archive the text content. If depth provided, act as a crawler and
-    scrape all links to a given depth.
+    scrape all links to a given depth. The pages are stored and committed in batches as they are crawled.
 
     :param urls: single URL or a list of URLs divided by commas
     :param depth: integer representing the depth of the crawler, None if no crawling is required
     :param ignored_url: URL representing the pattern to ignore
+    :param on_progress: called with a description of each step, e.g. by the ingestion jobs
     :return:
     """
     if isinstance(urls, str):
         urls = [urls]
 
-    loader = WebCrawler(depth=depth)
-    documents = loader.load_data(urls=urls, ignored_url=ignored_url)
-    logger.info(f"Loaded {len(documents)} documents from {len(urls)} URLs.")
-    for document in documents:
-        document.text = _clean(document.text)
+    cache = None
+    if app_settings.CRAWLER_CACHE_PATH:
+        cache = HttpCache(os.path.join(SRC_ROOT, app_settings.CRAWLER_CACHE_PATH),
+                          namespace=str(Org.current.get().id))
+    loader = WebCrawler(
+        depth=depth,
+        max_concurrency=app_settings.CRAWLER_MAX_CONCURRENCY,
+        max_connections_per_host=app_settings.CRAWLER_MAX_CONNECTIONS_PER_HOST,
+        max_pages=app_settings.CRAWLER_MAX_PAGES,
+        timeout=app_settings.CRAWLER_TIMEOUT,
+        cache=cache,
+        executor=get_executor(),
+    )
+    # the pages are parsed and cleaned while the previous ones are embedded and stored
+    pages = loader.lazy_load_data(urls=urls, ignored_url=ignored_url)
+    try:
+        _create_documents(clean_documents(pages), on_progress,
+                          on_stored=lambda documents: _cache_pages(loader, cache, documents))
+    finally:
+        pages.close()
+        if cache:
+            cache.close()
+
 
-    _create_documents(documents)
+def _cache_pages(loader: WebCrawler, cache: Optional[HttpCache], documents: List[Document]) -> None:
+    # the pages count as seen only once their chunks are committed
+    loader.cache_pages(document.metadata["URL"] for document in documents)
+    if cache:
+        cache.commit()
 
 
-def archive_files(directory: str) -> None:
+def archive_files(directory: str, on_progress: Optional[ProgressCallback] = None) -> None:
     path = os.path.join(SRC_ROOT, directory)
-    documents = SimpleDirectoryReader(path).load_data()
-    _create_documents(documents)
+    # one file at a time, its documents (e.g. PDF pages) one after the other
+    documents = chain.from_iterable(SimpleDirectoryReader(path).iter_data())
+    _create_documents(documents, on_progress)
+
 
+def archive_text(text: str, on_progress: Optional[ProgressCallback] = None) -> None:
+    document = Document(text=clean_text(text))
 
-def archive_text(text: str) -> None:
-    document = Document(text=_clean(text))
+    _create_documents([document], on_progress)
 
-    _create_documents([document])
 
+def retrieve(query: str, retriever_top_k: int = 5, filters: Optional[MetadataFilters] = None,
+             **search_kwargs) -> list[NodeWithScore]:
+    """
+    Retrieve the most similar nodes for the query in the current org.
 
-def retrieve(query: str, retriever_top_k: int = 5) -> list[NodeWithScore]:
-    index = _get_index()
-    query_bundle = QueryBundle(query)
+    :param filters: metadata filters of the nodes, e.g. on their URL, applied by the database
+    :param search_kwargs: ANN index scan parameters for `ChunkVectorStore.query`, e.g. `ef_search` or `probes`
+    """
+    retriever = get_retriever(retriever_top_k, filters, **search_kwargs)
+    # repeated questions don't go through the embedding API again
+    embedding = get_query_embedding(query, get_embed_model())
+    query_bundle = QueryBundle(query, embedding=embedding)
 
-    retriever = VectorIndexRetriever(
-        index=index,
-        similarity_top_k=retriever_top_k,
-    )
     nodes = retriever.retrieve(query_bundle)
 
     return nodes
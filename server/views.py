@@ -1,17 +1,20 @@
+import contextvars
 import logging
+import queue
+import threading
 
-import supabase
-from flask import Blueprint, abort
+from flask import Blueprint, Response, abort, stream_with_context
 from flask import request
-from gotrue.errors import AuthApiError
 from sqlalchemy import select
-from supabase import create_client
 
 import memory
-from bots.team import call_manager
+from auth import get_user
+from bots.callbacks import TokenQueueCallbackHandler
+from bots.team import MANAGER_TAG, call_manager
 from db import db
-from db.models import User, Chat, Org, Onboarding, OrgUser
-from settings import app_settings
+from db.models import User, Chat, IngestionJob, Org, Onboarding, OrgUser
+from utils.json import json_dumps
+from vdb import answer_cache
 
 api = Blueprint('api', __name__)
 logger = logging.getLogger(__name__)
@@ -28,15 +31,10 @@ def before_request():
     if not jwt:
         abort(401)
     jwt = jwt.split()[1]
-    supabase_client: supabase.Client = create_client(
-        app_settings.SUPABASE_URL,
-        app_settings.SUPABASE_KEY,
-    )
-    try:
-        user_response = supabase_client.auth.get_user(jwt)
-    except AuthApiError:
+    user = get_user(jwt)
+    if user is None:
         abort(401)
-    User.current.set(User.get(user_response.user.id))
+    User.current.set(user)
 
 
 @api.route('/chats', methods=['POST'])
@@ -63,13 +61,7 @@ def _create_chat(body):
 
 @api.route('/messages', methods=['POST'])
 def add_message():
-    query = (
-        select(Org)
-        .join(OrgUser, OrgUser.org_id == Org.id)
-        .where(OrgUser.user_id == User.current.get().id)
-    )
-    org = db.session.execute(query).scalar_one_or_none()
-    Org.current.set(org)
+    Org.current.set(_get_user_org())
 
     chat_memory = memory.load(request.json["chat_id"])
 
@@ -86,6 +78,65 @@ def add_message():
     return response
 
 
+@api.route('/messages/stream', methods=['POST'])
+def stream_message():
+    """
+    Same as add_message, but the answer of the manager is sent as server-sent events while it is produced:
+    a "token" event per token, then an "end" event with the same body add_message responds with, or an "error" event.
+    """
+    Org.current.set(_get_user_org())
+
+    body = request.json.copy()
+    chat_memory = memory.load(body["chat_id"])
+    manager = call_manager(chat_memory)
+    user_message = body["user_message"]
+
+    tokens = queue.Queue()
+    done = object()
+
+    def run_team():
+        try:
+            team_response = manager.run(user_message, callbacks=[TokenQueueCallbackHandler(tokens, MANAGER_TAG)])
+            memory.save(body["chat_id"], user_message, team_response)
+            logger.info(f"User message: {user_message} \n Support team response: {team_response}")
+            body["assistant"] = team_response
+            tokens.put(("end", body))
+        except Exception:
+            logger.exception("Support team failed to answer")
+            tokens.put(("error", {"error": "The support team failed to answer"}))
+        finally:
+            tokens.put(done)
+
+    # the team runs with the request context, so that it uses the same org and database session
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run_team,), daemon=True)
+
+    def events():
+        worker.start()
+        try:
+            while (event := tokens.get()) is not done:
+                # tokens come from the callback handler, the final events from run_team
+                yield _sse("token", {"token": event}) if isinstance(event, str) else _sse(*event)
+        finally:
+            # the client may leave early, the answer is still saved before the request context is torn down
+            worker.join()
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json_dumps(data)}\n\n"
+
+
+def _get_user_org() -> Org:
+    query = (
+        select(Org)
+        .join(OrgUser, OrgUser.org_id == Org.id)
+        .where(OrgUser.user_id == User.current.get().id)
+    )
+    return db.session.execute(query).scalar_one_or_none()
+
+
 @api.route('/onboarding', methods=['GET'])
 def onboarding():
     query = (
@@ -117,6 +168,33 @@ def brains_default():
     return {"name": "default", "description": "Default brain", "version": "1.0.0"}
 
 
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    return {"answer_cache": answer_cache.stats.as_dict()}
+
+
+@api.route('/ingestion-jobs/<uuid:job_id>', methods=['GET'])
+def ingestion_job(job_id):
+    query = (
+        select(IngestionJob)
+        .join(OrgUser, OrgUser.org_id == IngestionJob.org_id)
+        .where(IngestionJob.id == job_id, OrgUser.user_id == User.current.get().id)
+    )
+    job = db.session.execute(query).scalar_one_or_none()
+    if job is None:
+        abort(404)
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "finished_at": job.finished_at.strftime('%Y-%m-%dT%H:%M:%SZ') if job.finished_at else None,
+    }
+
+
 @api.route('/prompts', methods=['GET'])
 def prompts():
     return [{"name": "default"}]
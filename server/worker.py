@@ -0,0 +1,43 @@
+"""
+Workers of the ingestion jobs, see vdb.jobs. Run them with:
+
+    python worker.py --processes 4
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+
+from app import app
+from settings import app_settings
+from vdb import jobs
+
+logging.basicConfig(level=app_settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def work() -> None:
+    """Run the queued jobs one after the other, forever"""
+    logger.info("Ingestion worker started")
+    while True:
+        with app.app_context():
+            job = jobs.claim()
+            if job is not None:
+                logger.info(f"Running ingestion job {job.id} ({job.kind}) of org {job.org_id}")
+                jobs.run(job)
+                continue
+        time.sleep(app_settings.JOB_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the workers of the ingestion jobs')
+    parser.add_argument('--processes', type=int, default=app_settings.JOB_WORKER_PROCESSES,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+
+    # each process has its own connection pool, and its own pool of vdb.pipeline, which daemon processes can't have
+    processes = [multiprocessing.Process(target=work) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
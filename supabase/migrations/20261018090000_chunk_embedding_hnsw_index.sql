@@ -0,0 +1,6 @@
+alter table "public"."org" add column "ef_search" integer;
+
+alter table "public"."org" add column "probes" integer;
+
+CREATE INDEX chunk_embedding_hnsw_idx ON public.chunk USING hnsw (embedding vector_cosine_ops) WITH (m='16', ef_construction='64');
+
@@ -0,0 +1,31 @@
+create table "public"."source" (
+    "id" uuid not null default gen_random_uuid(),
+    "org_id" uuid not null,
+    "uri" text not null,
+    "content_hash" character varying(64) not null,
+    "updated_at" timestamp with time zone not null default now()
+);
+
+
+alter table "public"."source" enable row level security;
+
+alter table "public"."chunk" add column "source_id" uuid;
+
+CREATE UNIQUE INDEX source_pkey ON public.source USING btree (id);
+
+CREATE UNIQUE INDEX org_uri_unique_together ON public.source USING btree (org_id, uri);
+
+CREATE INDEX ix_chunk_source_id ON public.chunk USING btree (source_id);
+
+alter table "public"."source" add constraint "source_pkey" PRIMARY KEY using index "source_pkey";
+
+alter table "public"."source" add constraint "org_uri_unique_together" UNIQUE using index "org_uri_unique_together";
+
+alter table "public"."source" add constraint "source_org_id_fkey" FOREIGN KEY (org_id) REFERENCES org(id) ON DELETE CASCADE not valid;
+
+alter table "public"."source" validate constraint "source_org_id_fkey";
+
+alter table "public"."chunk" add constraint "chunk_source_id_fkey" FOREIGN KEY (source_id) REFERENCES source(id) ON DELETE CASCADE not valid;
+
+alter table "public"."chunk" validate constraint "chunk_source_id_fkey";
+
@@ -0,0 +1,24 @@
+create table "public"."cached_answer" (
+    "id" uuid not null default gen_random_uuid(),
+    "org_id" uuid not null,
+    "prompt_hash" character varying(64) not null,
+    "question" text not null,
+    "answer" text not null,
+    "embedding" vector(1536) not null,
+    "created_at" timestamp with time zone not null default now()
+);
+
+
+alter table "public"."cached_answer" enable row level security;
+
+CREATE UNIQUE INDEX cached_answer_pkey ON public.cached_answer USING btree (id);
+
+CREATE INDEX cached_answer_org_id_created_at_idx ON public.cached_answer USING btree (org_id, created_at);
+
+CREATE INDEX cached_answer_embedding_hnsw_idx ON public.cached_answer USING hnsw (embedding vector_cosine_ops) WITH (m='16', ef_construction='64');
+
+alter table "public"."cached_answer" add constraint "cached_answer_pkey" PRIMARY KEY using index "cached_answer_pkey";
+
+alter table "public"."cached_answer" add constraint "cached_answer_org_id_fkey" FOREIGN KEY (org_id) REFERENCES org(id) ON DELETE CASCADE not valid;
+
+alter table "public"."cached_answer" validate constraint "cached_answer_org_id_fkey";
@@ -0,0 +1,3 @@
+alter table "public"."chunk" add column "tsv" tsvector generated always as (to_tsvector('english', coalesce((data ->> '_node_content')::jsonb ->> 'text', data ->> 'text', ''))) stored;
+
+CREATE INDEX chunk_tsv_idx ON public.chunk USING gin (tsv);
@@ -0,0 +1 @@
+CREATE INDEX chunk_data_idx ON public.chunk USING gin ((data::jsonb) jsonb_path_ops);
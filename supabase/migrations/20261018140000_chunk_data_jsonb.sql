@@ -0,0 +1,12 @@
+-- the generated column and the expression index depend on the type of the column
+drop index if exists "public"."chunk_data_idx";
+
+alter table "public"."chunk" drop column "tsv";
+
+alter table "public"."chunk" alter column "data" type jsonb using "data"::jsonb;
+
+alter table "public"."chunk" add column "tsv" tsvector generated always as (to_tsvector('english', coalesce((data ->> '_node_content')::jsonb ->> 'text', data ->> 'text', ''))) stored;
+
+CREATE INDEX chunk_tsv_idx ON public.chunk USING gin (tsv);
+
+CREATE INDEX chunk_data_idx ON public.chunk USING gin (data jsonb_path_ops);
@@ -0,0 +1,23 @@
+-- each org has its own embedding model, the embedding columns have no fixed dimension anymore
+alter table "public"."org" add column "embedding_model" character varying(100) not null default 'text-embedding-ada-002';
+
+alter table "public"."org" add column "embedding_dim" integer not null default 1536;
+
+alter table "public"."org" alter column "embedding_model" drop default;
+
+alter table "public"."org" alter column "embedding_dim" drop default;
+
+drop index if exists "public"."chunk_embedding_hnsw_idx";
+
+drop index if exists "public"."cached_answer_embedding_hnsw_idx";
+
+alter table "public"."chunk" alter column "embedding" type vector;
+
+alter table "public"."chunk" add column "next_embedding" vector;
+
+alter table "public"."cached_answer" alter column "embedding" type vector;
+
+-- partial indexes of the embeddings of 1536 dimensions, on the embeddings cast to their dimension
+CREATE INDEX chunk_embedding_1536_hnsw_idx ON public.chunk USING hnsw ((embedding::vector(1536)) vector_cosine_ops) WITH (m='16', ef_construction='64') WHERE vector_dims(embedding) = 1536;
+
+CREATE INDEX cached_answer_embedding_1536_hnsw_idx ON public.cached_answer USING hnsw ((embedding::vector(1536)) vector_cosine_ops) WITH (m='16', ef_construction='64') WHERE vector_dims(embedding) = 1536;
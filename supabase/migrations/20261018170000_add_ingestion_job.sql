@@ -0,0 +1,30 @@
+create table "public"."ingestion_job" (
+    "id" uuid not null default gen_random_uuid(),
+    "org_id" uuid not null,
+    "kind" character varying(16) not null,
+    "params" jsonb not null,
+    "status" character varying(16) not null,
+    "progress" text,
+    "error" text,
+    "attempts" integer not null,
+    "created_at" timestamp with time zone not null default now(),
+    "run_after" timestamp with time zone not null default now(),
+    "started_at" timestamp with time zone,
+    "finished_at" timestamp with time zone,
+    "heartbeat_at" timestamp with time zone
+);
+
+
+alter table "public"."ingestion_job" enable row level security;
+
+CREATE UNIQUE INDEX ingestion_job_pkey ON public.ingestion_job USING btree (id);
+
+CREATE INDEX ingestion_job_status_run_after_idx ON public.ingestion_job USING btree (status, run_after);
+
+CREATE INDEX ingestion_job_org_id_status_idx ON public.ingestion_job USING btree (org_id, status);
+
+alter table "public"."ingestion_job" add constraint "ingestion_job_pkey" PRIMARY KEY using index "ingestion_job_pkey";
+
+alter table "public"."ingestion_job" add constraint "ingestion_job_org_id_fkey" FOREIGN KEY (org_id) REFERENCES org(id) ON DELETE CASCADE not valid;
+
+alter table "public"."ingestion_job" validate constraint "ingestion_job_org_id_fkey";
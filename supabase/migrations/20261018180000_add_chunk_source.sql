@@ -0,0 +1,36 @@
+create table "public"."chunk_source" (
+    "id" uuid not null default gen_random_uuid(),
+    "chunk_id" uuid not null,
+    "source_id" uuid not null
+);
+
+
+alter table "public"."chunk_source" enable row level security;
+
+CREATE UNIQUE INDEX chunk_source_pkey ON public.chunk_source USING btree (id);
+
+CREATE UNIQUE INDEX chunk_source_unique_together ON public.chunk_source USING btree (chunk_id, source_id);
+
+CREATE INDEX ix_chunk_source_source_id ON public.chunk_source USING btree (source_id);
+
+alter table "public"."chunk_source" add constraint "chunk_source_pkey" PRIMARY KEY using index "chunk_source_pkey";
+
+alter table "public"."chunk_source" add constraint "chunk_source_unique_together" UNIQUE using index "chunk_source_unique_together";
+
+alter table "public"."chunk_source" add constraint "chunk_source_chunk_id_fkey" FOREIGN KEY (chunk_id) REFERENCES chunk(id) ON DELETE CASCADE not valid;
+
+alter table "public"."chunk_source" validate constraint "chunk_source_chunk_id_fkey";
+
+alter table "public"."chunk_source" add constraint "chunk_source_source_id_fkey" FOREIGN KEY (source_id) REFERENCES source(id) ON DELETE CASCADE not valid;
+
+alter table "public"."chunk_source" validate constraint "chunk_source_source_id_fkey";
+
+-- a chunk may now belong to several sources
+insert into "public"."chunk_source" ("chunk_id", "source_id")
+select "id", "source_id" from "public"."chunk" where "source_id" is not null;
+
+alter table "public"."chunk" drop constraint "chunk_source_id_fkey";
+
+drop index if exists "public"."ix_chunk_source_id";
+
+alter table "public"."chunk" drop column "source_id";
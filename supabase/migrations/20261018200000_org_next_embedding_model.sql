@@ -0,0 +1,4 @@
+-- model of the chunks' next_embedding while an org is re-embedded
+alter table "public"."org" add column "next_embedding_model" character varying(100);
+
+alter table "public"."org" add column "next_embedding_dim" integer;